@@ -1,13 +1,45 @@
 import os
+import logging
+import queue
+import re
+from logging.handlers import QueueHandler, QueueListener
 import discord
+from discord import app_commands
 from discord.ext import commands
-import aiohttp
 import asyncio
-from datetime import datetime, timedelta
+import contextlib
+import orjson
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from types import MappingProxyType
 from dotenv import load_dotenv
+from yarl import URL
 
-# Load local environment variables if present
-load_dotenv()
+# Load local environment variables if present (container deploys already inject them)
+if os.getenv("DISCORD_BOT_TOKEN") is None:
+    load_dotenv()
+
+# Log records are enqueued on the event loop and written to stderr by a QueueListener thread.
+# The queue handler is attached only once the listener runs, so nothing piles up unwritten.
+log = logging.getLogger("newsbot")
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_queue = queue.SimpleQueue()
+_log_queue_handler = QueueHandler(_log_queue)
+_log_stream_handler = logging.StreamHandler()
+_log_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _log_stream_handler)
+
+def start_logging():
+    if _log_queue_handler in log.handlers: return
+    _log_listener.start()
+    log.addHandler(_log_queue_handler)
+
+def stop_logging():
+    if _log_queue_handler not in log.handlers: return
+    log.removeHandler(_log_queue_handler)
+    _log_listener.stop()  # flushes records still in the queue
 
 # Configuration from Environment Variables
 DISCORD_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
@@ -15,6 +47,21 @@ GITHUB_TOKEN = os.getenv("GITHUB_PAT")
 GITHUB_REPO = os.getenv("GITHUB_REPO", "emadprograms/news-network")
 WORKFLOW_FILENAME = os.getenv("WORKFLOW_FILENAME", "manual_run.yml")
 
+# Both values are interpolated into API paths, so reject anything beyond plain path segments
+if not re.fullmatch(r"[A-Za-z0-9._-]+/[A-Za-z0-9._-]+", GITHUB_REPO) or ".." in GITHUB_REPO:
+    raise ValueError(f"GITHUB_REPO must look like 'owner/repo', got {GITHUB_REPO!r}")
+if not re.fullmatch(r"[A-Za-z0-9._-]+\.ya?ml", WORKFLOW_FILENAME):
+    raise ValueError(f"WORKFLOW_FILENAME must be a .yml/.yaml file name, got {WORKFLOW_FILENAME!r}")
+
+# GitHub API endpoints and headers are fixed for the process lifetime (pre-encoded: aiohttp skips re-quoting)
+GITHUB_DISPATCH_URL = URL(f"https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_FILENAME}/dispatches", encoded=True)
+GITHUB_RUNS_URL = URL(f"https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_FILENAME}/runs", encoded=True)
+GITHUB_HEADERS = MappingProxyType({
+    "Accept": "application/vnd.github.v3+json",
+    "Authorization": f"Bearer {GITHUB_TOKEN}",
+    "X-GitHub-Api-Version": "2022-11-28"
+})
+
 # Friendly model aliases → actual KeyManager config IDs (free tier only)
 MODEL_ALIASES = {
     "flash":    "gemini-2.5-flash-free",
@@ -22,44 +69,163 @@ MODEL_ALIASES = {
     "lite":     "gemini-3.1-flash-lite-free",
     "3flash":   "gemini-3-flash-free",
 }
-AVAILABLE_MODELS = list(MODEL_ALIASES.keys())
+AVAILABLE_MODELS = tuple(MODEL_ALIASES)
+# Slash-command choices; prefix invocations may still type any case (resolved via .lower())
+MODEL_CHOICES = [app_commands.Choice(name=k, value=k) for k in AVAILABLE_MODELS]
+MODEL_ALIASES_DISPLAY = ", ".join(f"`{k}`" for k in AVAILABLE_MODELS)
+
+# Seconds to wait before each poll for the dispatched run's live link
+RUN_POLL_DELAYS = (1, 2, 4, 8)
+MAX_RATE_LIMIT_WAIT = 15
+
+def rate_limit_wait(headers) -> float:
+    """Seconds to back off after a GitHub 403/429, from Retry-After or X-RateLimit-Reset (capped)."""
+    if headers.get("Retry-After", "").isdigit():
+        return min(float(headers["Retry-After"]), MAX_RATE_LIMIT_WAIT)
+    if headers.get("X-RateLimit-Reset", "").isdigit():
+        return min(max(float(headers["X-RateLimit-Reset"]) - time.time(), 0), MAX_RATE_LIMIT_WAIT)
+    return RUN_POLL_DELAYS[-1]
+
+# Status message templates (static text built once; only the placeholders vary per command)
+STATUS_TMPL = (
+    "🧠 **Connecting to News Network LLM Engine...**\n"
+    "> **Date:** `{date}`\n"
+    "> **Model:** `{model}` → `{resolved}`\n"
+    "Dispatching signal to GitHub Actions..."
+)
+_FINAL_HEAD = (
+    "💠 **Transmission Successful!**\n"
+    "> **News Network LLM Engine** is now distilling data.\n"
+)
+_FINAL_TAIL = "> The optimized JSON payload and extraction report will be delivered here shortly. 🧠"
+FINAL_WITH_LINK_TMPL = "".join((_FINAL_HEAD, "> 🔗 **[Watch Live Extraction on GitHub]({live_url})**\n\n", _FINAL_TAIL))
+FINAL_NO_LINK_MSG = "".join((_FINAL_HEAD, "> (Live link could not be retrieved - check GitHub Actions manually)\n\n", _FINAL_TAIL))
+
+# Bounds in-flight GitHub calls across all concurrent /cleannews invocations
+_gh_sem = asyncio.Semaphore(8)
+# Strong references to in-flight polling tasks (the loop only keeps weak ones)
+_background_tasks = set()
 
-# Setup intents for message reading
-intents = discord.Intents.default()
-intents.message_content = True
+async def github_api(session, method, url, **kw):
+    """Single gated GitHub request; returns (status, body bytes, headers) with the connection released."""
+    async with _gh_sem:
+        async with session.request(method, url, **kw) as r:
+            if r.status == 204:
+                # No Content (successful dispatch): hand the connection straight back to the pool
+                r.release()
+                return r.status, b"", r.headers
+            return r.status, await r.read(), r.headers
+
+# Setup intents: slash commands arrive as interactions, so message content is not needed
+intents = discord.Intents.none()
+intents.guilds = True
+intents.guild_messages = True
+intents.dm_messages = True
+
+class NewsNetworkBot(commands.Bot):
+    """commands.Bot that owns one long-lived aiohttp session for all GitHub API calls."""
+    http_session = None
+
+    async def setup_hook(self):
+        import aiohttp
+        start_logging()  # no-op when __main__ already started it
+        # Keep-alive pool reused by every /cleannews dispatch and its run polling
+        self.http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, keepalive_timeout=60),
+            timeout=aiohttp.ClientTimeout(total=15),
+            json_serialize=lambda o: orjson.dumps(o).decode()
+        )
+        # Register /cleannews with Discord
+        await self.tree.sync()
+
+    async def close(self):
+        if self.http_session:
+            await self.http_session.close()
+        await super().close()
+        stop_logging()
 
 # Initialize Bot
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = NewsNetworkBot(
+    command_prefix=commands.when_mentioned_or("!"),  # text form still works in DMs and via @mention
+    intents=intents,
+    max_messages=None,
+    chunk_guilds_at_startup=False,
+    member_cache_flags=discord.MemberCacheFlags.none()
+)
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user.name} ({bot.user.id})')
-    print('Bot is ready to receive commands.')
+    log.info(f'Logged in as {bot.user.name} ({bot.user.id})')
+    log.info('Bot is ready to receive commands.')
+
+async def _poll_and_update(session, status_msg, ctx, runs_params, dispatched_after):
+    """Background follow-up to a successful dispatch: find the run's live link and edit status_msg once."""
+    try:
+        # Poll on a growing schedule (1s, 2s, 4s, 8s) and stop at the first run created by this dispatch.
+        # The typing indicator covers the wait for prefix invocations (slash invocations were deferred up front);
+        # status_msg is edited once with the outcome.
+        live_url = None
+        async with (ctx.typing() if ctx.interaction is None else contextlib.nullcontext()):
+            for attempt, delay in enumerate(RUN_POLL_DELAYS, 1):
+                await asyncio.sleep(delay)
+                log.info(f"Attempt {attempt} to fetch live link...")
+
+                runs_status, runs_body, runs_headers = await github_api(
+                    session, "GET", GITHUB_RUNS_URL, headers=GITHUB_HEADERS, params=runs_params
+                )
+                if runs_status == 200:
+                    runs = orjson.loads(runs_body).get("workflow_runs")
+                    # ISO-8601 UTC strings compare chronologically; older runs are a previous dispatch
+                    if runs and runs[0]["created_at"] >= dispatched_after:
+                        live_url = runs[0]["html_url"]
+                        break
+                elif runs_status in (403, 429):
+                    wait = rate_limit_wait(runs_headers)
+                    log.warning(f"Rate limited on attempt {attempt} ({runs_status}), waiting {wait:.0f}s")
+                    await asyncio.sleep(wait)
+                else:
+                    log.warning(f"Failed to fetch runs on attempt {attempt}: {runs_status}")
+
+        if live_url:
+            final_msg_content = FINAL_WITH_LINK_TMPL.format_map({"live_url": live_url})
+        else:
+            final_msg_content = FINAL_NO_LINK_MSG
+
+        await status_msg.edit(content=final_msg_content)
+    except Exception as e:
+        await status_msg.edit(content=f"💠 **Transmission Successful!**\n> (Live link lookup failed - check GitHub Actions manually)\n`{str(e)}`")
+        log.error(f"Exception polling for live link: {e}")
 
-@bot.command(name="cleannews")
-async def trigger_fetch(ctx, target_date: str = None, model: str = "lite"):
+@bot.hybrid_command(name="cleannews")
+@commands.max_concurrency(1, commands.BucketType.user, wait=False)
+@commands.cooldown(rate=3, per=60, type=commands.BucketType.guild)
+@app_commands.choices(model=MODEL_CHOICES)
+async def trigger_fetch(ctx, target_date: Optional[str] = None, model: str = "lite"):
     """Triggers the Clean News LLM Extraction workflow. 
-    Usage: !cleannews [YYYY-MM-DD] [model]
+    Usage: /cleannews [YYYY-MM-DD] [model]
     Models: flash (2.5 Flash), 2.5lite (2.5 Flash Lite), lite (3.1 Flash Lite), 3flash (3 Flash)"""
     
-    # Resolve friendly model alias
-    resolved_model = MODEL_ALIASES.get(model.lower())
+    # Slash invocations: acknowledge now ("thinking..." until the status message arrives)
+    if ctx.interaction is not None:
+        await ctx.defer()
+    
+    # Resolve friendly model alias (keys are lowercase; only lowercase the input on a miss)
+    resolved_model = MODEL_ALIASES.get(model) or MODEL_ALIASES.get(model.lower())
     if not resolved_model:
         await ctx.send(
             f"❌ **Unknown model:** `{model}`\n"
-            f"> Available models: {', '.join([f'`{k}`' for k in AVAILABLE_MODELS])}\n"
-            f"> Example: `!cleannews 2026-02-18 flash`"
+            f"> Available models: {MODEL_ALIASES_DISPLAY}\n"
+            f"> Example: `/cleannews 2026-02-18 flash`"
         )
         return
     
     # 🛡️ Validate date format BEFORE dispatching
     if target_date:
         try:
-            parsed = datetime.strptime(target_date, "%Y-%m-%d")
+            parsed = date.fromisoformat(target_date)
             
             # Allow targeting upcoming trading days (up to 5 days ahead) for weekends/holidays
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            max_future = today + timedelta(days=5)
+            max_future = date.today() + timedelta(days=5)
             
             if parsed > max_future:
                 await ctx.send(
@@ -68,7 +234,7 @@ async def trigger_fetch(ctx, target_date: str = None, model: str = "lite"):
                 )
                 return
                 
-            target_date = parsed.strftime("%Y-%m-%d")  # Normalize to clean format
+            target_date = parsed.isoformat()  # Normalize to clean format (3.11+ also accepts e.g. 20260218)
         except ValueError:
             await ctx.send(
                 f"❌ **Invalid date format:** `{target_date}`\n"
@@ -82,21 +248,9 @@ async def trigger_fetch(ctx, target_date: str = None, model: str = "lite"):
     
     # Visual feedback focused on News-Network identity
     status_msg = await ctx.send(
-        f"🧠 **Connecting to News Network LLM Engine...**\n"
-        f"> **Date:** `{target_date}`\n"
-        f"> **Model:** `{model}` → `{resolved_model}`\n"
-        f"Dispatching signal to GitHub Actions..."
+        STATUS_TMPL.format_map({"date": target_date, "model": model, "resolved": resolved_model})
     )
     
-    # Prepare GitHub API request
-    url = f"https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_FILENAME}/dispatches"
-    
-    headers = {
-        "Accept": "application/vnd.github.v3+json",
-        "Authorization": f"Bearer {GITHUB_TOKEN}",
-        "X-GitHub-Api-Version": "2022-11-28"
-    }
-    
     # We trigger the workflow on the 'main' branch
     data = {"ref": "main", "inputs": {}}
     
@@ -105,51 +259,47 @@ async def trigger_fetch(ctx, target_date: str = None, model: str = "lite"):
         data["inputs"]["target_date"] = target_date
     data["inputs"]["model"] = resolved_model
     
+    # Runs created before this point belong to earlier dispatches (margin absorbs clock skew)
+    dispatched_after = (datetime.now(timezone.utc) - timedelta(seconds=30)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    
+    # Server-side filter: only dispatch-triggered runs created since this dispatch, newest first
+    runs_params = {"event": "workflow_dispatch", "per_page": "1", "created": f">={dispatched_after}"}
+    
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                # GitHub returns 204 No Content on a successful dispatch
-                if response.status == 204:
-                    await status_msg.edit(content="💠 **Transmission Successful!**\n> **News Network** is initializing... Fetching live link... 📡")
-                    print(f"Triggered fetch via Discord user: {ctx.author}")
-                    
-                    # Try up to 3 times with 4s wait each (total 12s)
-                    live_url = None
-                    for attempt in range(1, 4):
-                        await asyncio.sleep(4)
-                        print(f"Attempt {attempt} to fetch live link...")
-                        
-                        runs_url = f"https://api.github.com/repos/{GITHUB_REPO}/actions/workflows/{WORKFLOW_FILENAME}/runs"
-                        async with session.get(runs_url, headers=headers) as runs_resp:
-                            if runs_resp.status == 200:
-                                runs_data = await runs_resp.json()
-                                if runs_data.get("workflow_runs"):
-                                    live_url = runs_data["workflow_runs"][0]["html_url"]
-                                    break
-                            else:
-                                print(f"Failed to fetch runs on attempt {attempt}: {runs_resp.status}")
-                    
-                    final_msg_content = (
-                        f"💠 **Transmission Successful!**\n"
-                        f"> **News Network LLM Engine** is now distilling data.\n"
-                    )
-                    if live_url:
-                        final_msg_content += f"> 🔗 **[Watch Live Extraction on GitHub]({live_url})**\n\n"
-                    else:
-                        final_msg_content += f"> (Live link could not be retrieved - check GitHub Actions manually)\n\n"
-                        
-                    final_msg_content += "> The optimized JSON payload and extraction report will be delivered here shortly. 🧠"
-                    
-                    await status_msg.edit(content=final_msg_content)
-                else:
-                    response_json = await response.json() if response.content_type == 'application/json' else {}
-                    error_details = response_json.get("message", await response.text())
-                    await status_msg.edit(content=f"❌ **Failed to trigger workflow.**\nGitHub API Error ({response.status}): `{error_details}`")
-                    print(f"Failed to trigger: {response.status} - {await response.text()}")
+        session = bot.http_session
+        status, body, _ = await github_api(session, "POST", GITHUB_DISPATCH_URL, headers=GITHUB_HEADERS, json=data)
+        # GitHub returns 204 No Content on a successful dispatch
+        if status == 204:
+            log.info(f"Triggered fetch via Discord user: {ctx.author}")
             
+            # Poll in the background so the command (and its concurrency slot) finishes after the dispatch
+            task = asyncio.create_task(_poll_and_update(session, status_msg, ctx, runs_params, dispatched_after))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+        else:
+            error_details = body.decode("utf-8", "replace")
+            try:
+                error_details = orjson.loads(body).get("message", error_details)
+            except (orjson.JSONDecodeError, AttributeError):
+                pass
+            await status_msg.edit(content=f"❌ **Failed to trigger workflow.**\nGitHub API Error ({status}): `{error_details}`")
+            log.error(f"Failed to trigger: {status} - {error_details}")
+        
     except Exception as e:
         await status_msg.edit(content=f"⚠️ **Internal Error:** Could not reach GitHub.\n`{str(e)}`")
-        print(f"Exception triggering workflow: {e}")
+        log.error(f"Exception triggering workflow: {e}")
+
+@trigger_fetch.error
+async def trigger_fetch_error(ctx, error):
+    """Fast feedback for rejected invocations (no dispatch, no GitHub calls)."""
+    if isinstance(error, commands.MaxConcurrencyReached):
+        await ctx.send("⏳ **Already running:** your previous `/cleannews` is still dispatching. Please wait for it to finish.")
+    elif isinstance(error, commands.CommandOnCooldown):
+        await ctx.send(f"🧊 **Slow down:** `/cleannews` was triggered too often here. Try again in {error.retry_after:.0f}s.")
+    else:
+        log.error(f"Error in /cleannews: {error}")
+        # Always answer: a deferred slash invocation would otherwise stay "thinking" forever
+        await ctx.send(f"⚠️ **Command failed:** `{error}`")
 
 if __name__ == "__main__":
     if not DISCORD_TOKEN:
@@ -159,5 +309,16 @@ if __name__ == "__main__":
         print("CRITICAL: GITHUB_PAT is missing.")
         exit(1)
         
-    print("Starting News Network bot...")
-    bot.run(DISCORD_TOKEN)
+    # libuv-based event loop where available (not on Windows); stock asyncio otherwise
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+        
+    start_logging()
+    log.info("Starting News Network bot...")
+    try:
+        bot.run(DISCORD_TOKEN)
+    finally:
+        stop_logging()
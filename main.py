@@ -4,11 +4,16 @@ import os
 import time
 import datetime
 import re
+from html import unescape
+from bisect import bisect_right
+from itertools import accumulate
+from functools import lru_cache
 import json
+import orjson
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import aiohttp
-import asyncio
 import imaplib
+import hashlib
+import gzip
 from email import message_from_bytes
 import quopri
 
@@ -18,109 +23,181 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from modules.market_utils import MarketCalendar
 from modules.db_client import NewsDatabase
 from modules.key_manager import KeyManager
-from modules.llm_client import GeminiClient
-from modules.text_optimizer import optimize_json_for_synthesis
+from modules.llm_client import GeminiClient, MAX_CONCURRENT_REQUESTS, MAX_QUOTA_WAIT, REQUEST_SLOTS
+from modules.resp_cache import ResponseCache
+from modules.text_optimizer import optimize_json_for_synthesis, merge_news_items
 from infisical_sdk import InfisicalSDKClient
 
 # --- UTILITY CONTEXT ---
+_RE_NON_ALNUM = re.compile(r'[^a-z0-9\s]')
+# ASCII fast path for normalize_text: the bytes _RE_NON_ALNUM would remove from ASCII text
+_ASCII_NON_ALNUM_BYTES = bytes(
+    c for c in range(128) if not (chr(c).isspace() or chr(c) in 'abcdefghijklmnopqrstuvwxyz0123456789')
+)
+
 def normalize_text(text):
     if not text: return ""
-    return re.sub(r'[^a-z0-9\s]', '', str(text).lower()).strip()
+    return _normalize_str(text if isinstance(text, str) else str(text))
 
-def find_missing_items(chunk, salvaged_items):
-    if not salvaged_items: return chunk
-    
-    extracted_sets = []
+@lru_cache(maxsize=65536)
+def _normalize_str(text):
+    text = text.lower()
+    if text.isascii():
+        return text.encode().translate(None, _ASCII_NON_ALNUM_BYTES).decode().strip()
+    return _RE_NON_ALNUM.sub('', text).strip()
+
+def title_token_sets(chunk):
+    return [set(normalize_text(item.get('title', 'Unknown')).split()) for item in chunk]
+
+def build_headline_index(salvaged_items):
+    index = {}
+    headline_id = 0
     for item in salvaged_items:
         for h in item.get('source_headlines', []):
             norm = normalize_text(h)
             if norm:
-                extracted_sets.append(set(norm.split()))
+                for token in set(norm.split()):
+                    index.setdefault(token, []).append(headline_id)
+                headline_id += 1
+    return index
+
+def find_missing_items(chunk, salvaged_items, title_sets=None):
+    if not salvaged_items: return chunk
+    if title_sets is None: title_sets = title_token_sets(chunk)
+    
+    index = build_headline_index(salvaged_items)
     
     missing_items = []
-    for item in chunk:
-        title = item.get('title', 'Unknown')
-        norm_title = normalize_text(title)
-        if not norm_title:
+    for item, title_tokens in zip(chunk, title_sets):
+        if not title_tokens:
             missing_items.append(item)
             continue
-            
-        title_tokens = set(norm_title.split())
-        is_found = False
         
-        for e_tokens in extracted_sets:
-            if not title_tokens: continue
-            intersection = title_tokens.intersection(e_tokens)
-            overlap = len(intersection) / len(title_tokens)
-            if overlap >= 0.85:
-                is_found = True
-                break
-                
-        if not is_found:
+        shared = {}
+        for token in title_tokens:
+            for headline_id in index.get(token, ()):
+                shared[headline_id] = shared.get(headline_id, 0) + 1
+        
+        required = 17 * len(title_tokens)
+        if not any(count * 20 >= required for count in shared.values()):
             missing_items.append(item)
             
     return missing_items
 
+def match_headlines(norm_headlines, norm_sources):
+    if not norm_sources: return set()
+    # '\0' never survives normalize_text, so a match cannot straddle two joined strings
+    all_sources = "\0".join(norm_sources)
+    hits = {h for h in norm_headlines if h in norm_sources or h in all_sources}
+    
+    pending = [h for h in norm_headlines if h not in hits]
+    if pending:
+        all_pending = "\0".join(pending)
+        starts = [0, *accumulate(len(h) + 1 for h in pending)]
+        for s in norm_sources:
+            pos = all_pending.find(s)
+            while pos != -1:
+                idx = bisect_right(starts, pos) - 1
+                hits.add(pending[idx])
+                pos = all_pending.find(s, starts[idx + 1]) # one hit per headline is enough
+    return hits
+
+def strip_tags(text):
+    if '<' not in text: return text
+    out = []
+    i = 0
+    while True:
+        lt = text.find('<', i)
+        if lt < 0: break
+        gt = text.find('>', lt + 1)
+        if gt < 0: break
+        # "<>" is not a tag and stays in the text
+        out.append(text[i:gt + 1] if gt == lt + 1 else text[i:lt])
+        i = gt + 1
+    out.append(text[i:])
+    return "".join(out)
+
+def html_to_text(text):
+    text = strip_tags(text)
+    return unescape(text) if '&' in text else text
+
 def clean_content(content_list):
     if not content_list: return []
-    full_text = " ".join(content_list)
-    clean_text = re.sub(r'<[^>]+>', '', full_text)
-    
     paragraphs = []
     if len(content_list) <= 1:
-        parts = clean_text.split(". ")
-        current_p = ""
-        for p in parts:
-            current_p += p + ". "
-            if len(current_p) > 200: 
-                paragraphs.append(current_p.strip())
-                current_p = ""
-        if current_p: paragraphs.append(current_p.strip())
+        clean_text = html_to_text(" ".join(c for c in content_list if c))
+        current = [] # sentences of the paragraph being built; joined once it passes 200 chars
+        current_len = 0
+        for p in clean_text.split(". "):
+            current.append(p)
+            current_len += len(p) + 2
+            if current_len > 200: 
+                paragraphs.append((". ".join(current) + ". ").strip())
+                current, current_len = [], 0
+        if current: paragraphs.append((". ".join(current) + ". ").strip())
     else:
-        paragraphs = [re.sub(r'<[^>]+>', '', c).strip() for c in content_list if c.strip()]
+        paragraphs = [html_to_text(c).strip() for c in content_list if c and c.strip()]
     return paragraphs
 
-def chunk_data(items, max_tokens=10000):
+def get_item_body(item):
+    body = item.get('_body')
+    if body is None:
+        body = item['_body'] = " ".join(clean_content(item.get('content', [])))
+    return body
+
+def estimate_item_tokens(item, body):
+    meta_len = len(str(item.get('time'))) + len(str(item.get('title'))) + len(str(item.get('publisher'))) + 2
+    return int((len(body) + meta_len + 50) / KeyManager.CHARS_PER_TOKEN)
+
+def chunk_data(items, max_tokens=KeyManager.CHUNK_TOKEN_BUDGET):
     chunks = []
-    current_chunk = []
-    current_tokens = 0
     flat_items = []
-    limit_chars = int(max_tokens * 2.5)
+    item_tokens = [] # per flat item, estimated in the same pass
+    limit_chars = int(max_tokens * KeyManager.CHARS_PER_TOKEN)
     
     for item in items:
-        body = " ".join(clean_content(item.get('content', [])))
+        body = get_item_body(item)
         if len(body) > limit_chars:
             parts = [body[i:i+limit_chars] for i in range(0, len(body), limit_chars)]
+            orig_title = item.get('title', 'No Title')
             for p_idx, p_text in enumerate(parts):
-                new_item = item.copy()
-                orig_title = item.get('title', 'No Title')
-                new_item['title'] = f"[Part {p_idx+1}/{len(parts)}] {orig_title}"
-                new_item['content'] = [p_text]
-                flat_items.append(new_item)
+                # Slim record, not item.copy(): only the fields prompts, token estimates and checkpoint ids read
+                part = {
+                    'time': item.get('time'),
+                    'title': f"[Part {p_idx+1}/{len(parts)}] {orig_title}",
+                    'publisher': item.get('publisher'),
+                    'content': [p_text],
+                    '_body': p_text # already cleaned, skip re-cleaning downstream
+                }
+                flat_items.append(part)
+                item_tokens.append(estimate_item_tokens(part, p_text))
         else:
             flat_items.append(item)
+            item_tokens.append(estimate_item_tokens(item, body))
 
-    for item in flat_items:
-        body = " ".join(clean_content(item.get('content', [])))
-        meta = f"{item.get('time')} {item.get('title')} {item.get('publisher')}"
-        total_chars = len(body) + len(meta) + 50 
-        est_tok = int(total_chars / 2.5)
-        
-        if (current_tokens + est_tok) > max_tokens and current_chunk:
-            chunks.append(current_chunk)
-            current_chunk = []
-            current_tokens = 0
-            
-        current_chunk.append(item)
-        current_tokens += est_tok
-        
-    if current_chunk:
-        chunks.append(current_chunk)
+    cum_tokens = list(accumulate(item_tokens))
+    start = 0
+    while start < len(flat_items):
+        base = cum_tokens[start - 1] if start else 0
+        # Always take at least one item, even if it alone exceeds the budget
+        end = max(bisect_right(cum_tokens, base + max_tokens, lo=start), start + 1)
+        chunks.append(flat_items[start:end])
+        start = end
         
     return chunks
 
-def build_chunk_prompt(chunk, index, total, market_data_text, headline_inventory):
-    prompt = f"""SYSTEM NOTICE: This is PART {index} of {total}.
+def build_chunk_context(chunk):
+    headline_parts = []
+    context_parts = []
+    for idx, item in enumerate(chunk, 1):
+        t = item.get('time', 'N/A')
+        title = item.get('title', 'No Title')
+        body = get_item_body(item)
+        headline_parts.append(f"- {title}\n")
+        context_parts.append(f"--- SOURCE {idx} ---\nTITLE: {title}\nTIME: {t}\nCONTENT: {body}\n\n")
+    return "".join(context_parts), "".join(headline_parts)
+
+_CHUNK_PROMPT_TEMPLATE = """SYSTEM NOTICE: This is PART {index} of {total}.
 
 *** ROLE ***
 You are a high-fidelity Data Extraction Engine. Your sole purpose is to convert unstructured news text into a structured, machine-readable JSON dataset.
@@ -165,51 +242,186 @@ Output a valid JSON object with the following schema:
 === MARKET DATA STARTS BELOW ===
 {market_data_text}
 """
-    return prompt
+
+# Static prompt text around the four substitutions, split once at import
+(_PROMPT_HEAD, _PROMPT_AFTER_INDEX, _PROMPT_AFTER_TOTAL,
+ _PROMPT_AFTER_INVENTORY, _PROMPT_TAIL) = _CHUNK_PROMPT_TEMPLATE.format(
+    index='\0', total='\0', headline_inventory='\0', market_data_text='\0'
+).split('\0')
+
+# Appended once to the prompt after an unparseable reply, before falling back to residual/branch splitting
+_SCHEMA_REMINDER = "\n\nREMINDER: Your previous reply was not valid JSON. Return ONLY a valid JSON object matching the OUTPUT FORMAT schema above, starting with '{' and ending with '}'."
+
+def build_chunk_prompt(chunk, index, total, market_data_text, headline_inventory):
+    return f"{_PROMPT_HEAD}{index}{_PROMPT_AFTER_INDEX}{total}{_PROMPT_AFTER_TOTAL}{headline_inventory}{_PROMPT_AFTER_INVENTORY}{market_data_text}{_PROMPT_TAIL}"
+
+_RE_OBJ_GAP = re.compile(r'\}\s*\{')
+_RE_ARR_GAP = re.compile(r'\]\s*\[')
+_RE_TRAIL_COMMA_OBJ = re.compile(r',\s*\}')
+_RE_TRAIL_COMMA_ARR = re.compile(r',\s*\]')
+# [^\S\n]* stops at the first newline, so whitespace runs are not re-split while backtracking
+_RE_KV_NEWLINE = re.compile(r'\"[^\S\n]*\n\s*\"')
+# (?<!\d): don't restart \d+ inside a digit run (quadratic on long numbers)
+_RE_LITERAL_NEWLINE = re.compile(r'((?<!\d)\d+|true|false|null)[^\S\n]*\n\s*\"')
+_RE_MISSING_COLON = re.compile(r'\"([a-zA-Z0-9_]+)\"\s+\"([^\"]+)\"')
+_RE_SALVAGE_START = re.compile(r'\{\s*"category":')
+_RE_SALVAGE_TOKEN = re.compile(r'[{}"\\]')
+_RE_BRACE = re.compile(r'[{}]')
+_RE_JSON_STRUCT = re.compile(r'[{}\[\]"\\]')
 
 def repair_json_content(json_str):
     json_str = json_str.strip()
-    json_str = re.sub(r'\}\s*\{', '}, {', json_str)
-    json_str = re.sub(r'\]\s*\[', '], [', json_str)
-    json_str = re.sub(r',\s*\}', '}', json_str)
-    json_str = re.sub(r',\s*\]', ']', json_str)
-    json_str = re.sub(r'\"\s*\n\s*\"', '", "', json_str)
-    json_str = re.sub(r'(\d+|true|false|null)\s*\n\s*\"', r'\1, "', json_str)
-    json_str = re.sub(r'\"([a-zA-Z0-9_]+)\"\s+\"([^\"]+)\"', r'"\1": "\2"', json_str)
+    json_str = _RE_OBJ_GAP.sub('}, {', json_str)
+    json_str = _RE_ARR_GAP.sub('], [', json_str)
+    json_str = _RE_TRAIL_COMMA_OBJ.sub('}', json_str)
+    json_str = _RE_TRAIL_COMMA_ARR.sub(']', json_str)
+    json_str = _RE_KV_NEWLINE.sub('", "', json_str)
+    json_str = _RE_LITERAL_NEWLINE.sub(r'\1, "', json_str)
+    json_str = _RE_MISSING_COLON.sub(r'"\1": "\2"', json_str)
     return json_str
 
+def close_json(json_str):
+    in_string = False
+    skip_idx = -1 # index of the character consumed by a backslash escape
+    closers = []
+    for match in _RE_JSON_STRUCT.finditer(json_str):
+        i = match.start()
+        if i == skip_idx: continue
+        ch = json_str[i]
+        if in_string:
+            if ch == '\\':
+                skip_idx = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            closers.append('}')
+        elif ch == '[':
+            closers.append(']')
+        elif ch in '}]' and closers and closers[-1] == ch:
+            closers.pop()
+
+    if in_string:
+        if skip_idx == len(json_str): json_str = json_str[:-1]
+        json_str += '"'
+    elif closers:
+        json_str = json_str.rstrip().rstrip(',')
+    return json_str + "".join(reversed(closers))
+
+def strip_md_fence(text):
+    fence_start = text.find("```")
+    if fence_start == -1: return text
+    fence_end = text.rfind("```")
+    if fence_end == fence_start: return text
+    return text[fence_start + 3:fence_end].removeprefix("json").strip()
+
+def loads_lenient(raw):
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw, strict=False)
+
+def parse_llm_json(raw_json):
+    try:
+        return orjson.loads(raw_json)  # responseMimeType=json: usually valid as-is
+    except orjson.JSONDecodeError:
+        pass
+    
+    raw_json = strip_md_fence(raw_json.strip())
+    
+    if not raw_json.startswith("{"):
+        brace_start, brace_end = raw_json.find("{"), raw_json.rfind("}")
+        if -1 < brace_start < brace_end:
+            raw_json = raw_json[brace_start:brace_end + 1]
+    
+    try:
+        return orjson.loads(raw_json)
+    except orjson.JSONDecodeError:
+        pass
+    
+    # Truncated output (max tokens hit) is otherwise well-formed: closing it is one scan, no regex repair passes
+    closed = close_json(raw_json)
+    try:
+        return orjson.loads(closed)
+    except orjson.JSONDecodeError:
+        pass
+    
+    return loads_lenient(close_json(repair_json_content(raw_json)))
+
+def salvage_object_at(text, start_idx):
+    depth = 0
+    for match in _RE_BRACE.finditer(text, start_idx):
+        depth += 1 if match.group() == '{' else -1
+        if depth == 0:
+            try:
+                obj = loads_lenient(text[start_idx:match.end()])
+                return obj if isinstance(obj, dict) and "category" in obj else None
+            except:
+                return None
+    return None
+
 def salvage_json_items(text: str) -> list:
     if not text: return []
-    items = []
+    found = {} # item start -> parsed object
+    open_braces = [] # positions of '{' not yet closed
+    in_string = False
+    skip_idx = -1
     
-    start_pattern = r'\{\s*"category":'
-    for match in re.finditer(start_pattern, text):
-        start_idx = match.start()
-        
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(text)):
-            if text[i] == '{':
-                brace_count += 1
-            elif text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i + 1
-                    break
-        
-        if end_idx != -1:
+    for match in _RE_SALVAGE_TOKEN.finditer(text):
+        i = match.start()
+        if i == skip_idx: continue
+        ch = text[i]
+        if in_string:
+            if ch == '\\': skip_idx = i + 1
+            elif ch == '"': in_string = False
+            elif ch == '{' and _RE_SALVAGE_START.match(text, i):
+                # An item start can't sit inside a valid string (its quotes would be escaped):
+                # a stray quote earlier flipped the state, so resync here and drop the broken item
+                in_string = False
+                open_braces = [i]
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            open_braces.append(i)
+        elif ch == '}' and open_braces:
+            start_idx = open_braces.pop()
+            if not _RE_SALVAGE_START.match(text, start_idx): continue
             try:
-                obj_str = text[start_idx:end_idx].strip()
-                if obj_str.endswith(','): obj_str = obj_str[:-1].strip()
-                
-                obj = json.loads(obj_str, strict=False)
+                obj = loads_lenient(text[start_idx:i + 1])
                 if isinstance(obj, dict) and "category" in obj:
-                    items.append(obj)
+                    found[start_idx] = obj
             except: 
                 continue
-                
+    
+    # Unbalanced quotes/escapes can still hide items from the string-aware pass:
+    # retry any missed start with a plain brace count, so nothing is lost that a per-start scan finds
+    for match in _RE_SALVAGE_START.finditer(text):
+        start_idx = match.start()
+        if start_idx not in found:
+            obj = salvage_object_at(text, start_idx)
+            if obj is not None:
+                found[start_idx] = obj
+    items = [found[start_idx] for start_idx in sorted(found)]
+    
+    fragment_start = next((p for p in reversed(open_braces) if _RE_SALVAGE_START.match(text, p)), -1)
+    if fragment_start != -1 and fragment_start not in found:
+        try:
+            obj = loads_lenient(close_json(text[fragment_start:].strip()))
+            if isinstance(obj, dict) and "category" in obj:
+                obj['event_summary'] = f"{str(obj.get('event_summary') or '').strip()} [RECOVERED FRAGMENT]".strip()
+                obj['is_truncated'] = True
+                items.append(obj)
+        except:
+            pass
+             
     return items
 
+_RE_HTML_STYLE = re.compile(r'<style.*?>.*?</style>', re.DOTALL)
+_RE_HTML_SCRIPT = re.compile(r'<script.*?>.*?</script>', re.DOTALL)
+_RE_HTML_TAG = re.compile(r'<[^>]+>')
+_RE_BLANK_LINES = re.compile(r'\n\s*\n')
+
 def fetch_stock_analysis_email(gmail_user, gmail_pass, session_date):
     """
     Connects to Gmail via IMAP, searches for an email from contact@stockanalysis.com
@@ -263,10 +475,10 @@ def fetch_stock_analysis_email(gmail_user, gmail_pass, session_date):
             body = msg_obj.get_payload(decode=True).decode(errors='ignore')
 
         if "<body" in body or "<div" in body:
-            body = re.sub(r'<style.*?>.*?</style>', '', body, flags=re.DOTALL)
-            body = re.sub(r'<script.*?>.*?</script>', '', body, flags=re.DOTALL)
-            body = re.sub(r'<[^>]+>', '\n', body)
-            body = re.sub(r'\n\s*\n', '\n', body).strip()
+            body = _RE_HTML_STYLE.sub('', body)
+            body = _RE_HTML_SCRIPT.sub('', body)
+            body = _RE_HTML_TAG.sub('\n', body)
+            body = _RE_BLANK_LINES.sub('\n', body).strip()
             try:
                 body = quopri.decodestring(body).decode('utf-8', errors='ignore')
             except:
@@ -287,26 +499,24 @@ def extract_chunk_worker_cli(worker_data):
     last_raw_content = ""
     api_call_count = 0
     best_parsed_items = []
+    quota_hit = False # last trial never reached the model (rate limit)
+    reminder_sent = False # schema reminder already appended to the prompt
+    retry_with_reminder = False # next trial re-asks the whole chunk instead of splitting
     
-    headline_inventory = ""
-    context_for_prompt = ""
-    for idx, item in enumerate(chunk, 1):
-        t = item.get('time', 'N/A')
-        title = item.get('title', 'No Title')
-        body = " ".join(clean_content(item.get('content', [])))
-        headline_inventory += f"- {title}\n"
-        context_for_prompt += f"--- SOURCE {idx} ---\nTITLE: {title}\nTIME: {t}\nCONTENT: {body}\n\n"
+    context_for_prompt, headline_inventory = build_chunk_context(chunk)
     
     display_name = f"Part {i_display}" if depth == 0 else f"Branch {i_display}"
     p = build_chunk_prompt(chunk, i_display, total_chunks, context_for_prompt, headline_inventory)
+    token_est = km.estimate_tokens(p) if km else None  # re-estimated only when the schema reminder is appended
+    title_sets = title_token_sets(chunk)  # chunk titles are fixed across retries
     
     attempt, max_attempts = 0, 5
     while attempt < max_attempts:
         attempt += 1
         
-        if attempt >= 2 and len(chunk) > 1:
+        if attempt >= 2 and len(chunk) > 1 and not quota_hit and not retry_with_reminder:
             salvaged_so_far = best_parsed_items if best_parsed_items else (salvage_json_items(last_raw_content) if last_raw_content else [])
-            missing_items = find_missing_items(chunk, salvaged_so_far)
+            missing_items = find_missing_items(chunk, salvaged_so_far, title_sets)
             
             if not missing_items:
                 worker_logs.append(f"✅ [{display_name}] Residue Check: All {len(chunk)} stories accounted for across {len(salvaged_so_far)} items!")
@@ -332,8 +542,20 @@ def extract_chunk_worker_cli(worker_data):
             left_chunk = chunk[:mid]
             right_chunk = chunk[mid:]
             
-            res_l = extract_chunk_worker_cli((f"{i_display}.A", left_chunk, total_chunks, selected_model, depth + 1, ai_client, km))
-            res_r = extract_chunk_worker_cli((f"{i_display}.B", right_chunk, total_chunks, selected_model, depth + 1, ai_client, km))
+            left_data = (f"{i_display}.A", left_chunk, total_chunks, selected_model, depth + 1, ai_client, km)
+            right_data = (f"{i_display}.B", right_chunk, total_chunks, selected_model, depth + 1, ai_client, km)
+            if REQUEST_SLOTS.acquire(blocking=False):
+                try:
+                    with ThreadPoolExecutor(max_workers=1) as branch_pool:
+                        future_r = branch_pool.submit(extract_chunk_worker_cli, right_data)
+                        res_l = extract_chunk_worker_cli(left_data)
+                        res_r = future_r.result()
+                finally:
+                    REQUEST_SLOTS.release()
+            else:
+                # No free slot: run the halves one after the other on this thread
+                res_l = extract_chunk_worker_cli(left_data)
+                res_r = extract_chunk_worker_cli(right_data)
             
             success_l, items_l, logs_l, calls_l = res_l
             success_r, items_r, logs_r, calls_r = res_r
@@ -352,41 +574,23 @@ def extract_chunk_worker_cli(worker_data):
                 worker_logs.append(f"❌ [{display_name}] Branch failure persisted.")
                 return (False, combined_items, worker_logs, api_call_count)
 
+        quota_hit = retry_with_reminder = False
         try:
-            token_est = km.estimate_tokens(p) if km else "N/A"
-            worker_logs.append(f"🔹 [{display_name}] Trial {attempt} - Extraction in progress... (~{token_est} tokens)")
+            worker_logs.append(f"🔹 [{display_name}] Trial {attempt} - Extraction in progress... (~{token_est or 'N/A'} tokens)")
             api_call_count += 1
-            res = ai_client.generate_content(p, config_id=selected_model)
+            res = ai_client.generate_content(p, config_id=selected_model, est_tokens=token_est)
             
             if res['success']:
                 content = res['content']
                 last_raw_content = content 
-                raw_json = content.strip()
-                
-                if "```json" in raw_json:
-                    match = re.search(r"```json\s*(.*?)\s*```", raw_json, re.DOTALL)
-                    if match: raw_json = match.group(1).strip()
-                elif "```" in raw_json:
-                     match = re.search(r"```\s*(.*?)\s*```", raw_json, re.DOTALL)
-                     if match: raw_json = match.group(1).strip()
-                
-                if not raw_json.startswith("{"):
-                    match = re.search(r"(\{.*\})", raw_json, re.DOTALL)
-                    if match: raw_json = match.group(1).strip()
-                
-                raw_json = repair_json_content(raw_json)
-                if raw_json.strip().endswith("}") is False:
-                     if not raw_json.strip().endswith(('"', ',', '}', ']')): raw_json += '"'
-                     if raw_json.count('{') > raw_json.count('}'): raw_json += '}]}'
-
                 try:
-                    data = json.loads(raw_json, strict=False)
+                    data = parse_llm_json(content)
                     items = data if isinstance(data, list) else data.get("news_items", [])
                     
                     if len(items) > len(best_parsed_items):
                         best_parsed_items = items
                         
-                    missing_now = find_missing_items(chunk, items)
+                    missing_now = find_missing_items(chunk, items, title_sets)
                     recovered_count = len(chunk) - len(missing_now)
                     min_req = len(chunk) * 0.95
                     
@@ -395,6 +599,8 @@ def extract_chunk_worker_cli(worker_data):
                         time.sleep(1)
                         continue 
                         
+                    if recovered_count >= min_req and res.get('key_name') != 'cache':
+                        ai_client.cache_response(p, selected_model, content)
                     worker_logs.append(f"✅ [{display_name}] Success! {len(items)} items ({recovered_count}/{len(chunk)} headlines). (Key: {res.get('key_name', 'Unknown')})")
                     return (True, items, worker_logs, api_call_count)
                     
@@ -403,7 +609,7 @@ def extract_chunk_worker_cli(worker_data):
                     if any(k in err_str for k in ["delimiter", "double quotes", "expecting value", "unterminated"]):
                         salvaged = salvage_json_items(content)
                         if salvaged:
-                            missing_salvage = find_missing_items(chunk, salvaged)
+                            missing_salvage = find_missing_items(chunk, salvaged, title_sets)
                             recovered_salvage = len(chunk) - len(missing_salvage)
                             if recovered_salvage < min_req and attempt < max_attempts:
                                 worker_logs.append(f"⚠️ [{display_name}] Eager Salvage Rejected: Low yield ({recovered_salvage}/{len(chunk)} headlines). Retrying...")
@@ -412,13 +618,29 @@ def extract_chunk_worker_cli(worker_data):
                                 
                             worker_logs.append(f"⚡ [{display_name}] Eager Salvage: Recovered {recovered_salvage}/{len(chunk)} headlines.")
                             return (True, salvaged, worker_logs, api_call_count)
+                    if not reminder_sent and attempt < max_attempts:
+                        # Cheaper than branching: re-ask once with the schema spelled out
+                        reminder_sent = retry_with_reminder = True
+                        p += _SCHEMA_REMINDER
+                        token_est = km.estimate_tokens(p) if km else None
+                        worker_logs.append(f"🔁 [{display_name}] Unparseable JSON ({json_err}). Re-prompting once with a schema reminder...")
+                        time.sleep(1)
+                        continue
                     raise json_err
             else:
                 err_msg = res['content']
                 wait_sec = res.get('wait_seconds', 0)
                 if wait_sec > 0:
-                    worker_logs.append(f"⏳ [{display_name}] Quota hit (Key: {res.get('key_name', 'Unknown')}). Rotating keys...")
-                    time.sleep(1) 
+                    if res.get('key_name', 'N/A') != 'N/A':
+                        # A 429 on a served key only benches that key: rotate to the next one promptly
+                        wait_sec = 1
+                        worker_logs.append(f"⏳ [{display_name}] Quota hit (Key: {res['key_name']}). Rotating keys...")
+                    else:
+                        # Every key is throttled: sleep until the earliest one frees instead of re-polling KeyManager each second
+                        wait_sec = min(wait_sec, MAX_QUOTA_WAIT)
+                        worker_logs.append(f"⏳ [{display_name}] Quota hit on all keys. Waiting {wait_sec:.0f}s for the next free key...")
+                    quota_hit = True
+                    time.sleep(wait_sec)
                     continue
                 else:
                     worker_logs.append(f"❌ [{display_name}] Trial {attempt} failed: {err_msg} (Key: {res.get('key_name', 'Unknown')})")
@@ -430,7 +652,7 @@ def extract_chunk_worker_cli(worker_data):
     if last_raw_content:
         salvaged = salvage_json_items(last_raw_content)
         if salvaged:
-            missing_final = find_missing_items(chunk, salvaged)
+            missing_final = find_missing_items(chunk, salvaged, title_sets)
             recovered_final = len(chunk) - len(missing_final)
             if recovered_final >= (len(chunk) * 0.95):
                 worker_logs.append(f"🩹 [{display_name}] Emergency Salvage: {recovered_final}/{len(chunk)} headlines.")
@@ -441,37 +663,72 @@ def extract_chunk_worker_cli(worker_data):
     return (False, [], worker_logs, api_call_count)
 
 
+def extract_chunk_in_slot_cli(worker_data):
+    # Top-level part: holds one REQUEST_SLOTS slot for its whole run (branches borrow spare ones)
+    with REQUEST_SLOTS:
+        return extract_chunk_worker_cli(worker_data)
+
+# --- CHECKPOINTS ---
+# Successful chunks are appended as JSONL per session date, so an interrupted run can resume (--resume) where it stopped.
+# The file is removed once every chunk has succeeded; without --resume a run starts it afresh.
+CHECKPOINT_DIR = "checkpoints"
+
+def chunk_checkpoint_id(chunk, model):
+    return hashlib.blake2b(orjson.dumps([model, [item.get('title') for item in chunk]]), digest_size=16).hexdigest()
+
+def load_checkpoints(path):
+    done = {}
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = orjson.loads(line)
+                    done[record["chunk_id"]] = record["items"]
+                except (orjson.JSONDecodeError, KeyError, TypeError):
+                    continue # torn last line from an interrupted write
+    except FileNotFoundError:
+        pass
+    return done
+
+
 # --- DISCORD INTEGRATION ---
-async def send_discord_report(webhook_url, summary_text, optimized_text, file_name, embeds):
+# Webhook attachment cap; larger payloads are gzipped rather than rejected by Discord
+DISCORD_MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+def send_discord_report(session, webhook_url, summary_text, optimized_text, file_name, embeds):
     try:
         data = {"embeds": embeds}
         
-        async with aiohttp.ClientSession() as session:
-            # 1. Send the Dashboard Embed first
-            async with session.post(webhook_url, json=data) as response:
-                if response.status not in (200, 204):
-                    print(f"Failed to send dashboard to Discord. Status: {response.status}, text: {await response.text()}")
-                else:
-                    print("✅ Successfully pushed dashboard report to Discord!")
-            
-            # Small delay to guarantee ordering
-            await asyncio.sleep(1)
-            
-            # 2. Send the actual file in a separate message
-            form = aiohttp.FormData()
-            form.add_field('content', "📦 **Distilled Payload Attachment:**")
-            form.add_field('file', optimized_text.encode('utf-8'), filename=file_name, content_type='text/plain')
-            
-            async with session.post(webhook_url, data=form) as response:
-                if response.status not in (200, 204):
-                    print(f"Failed to send file to Discord. Status: {response.status}, text: {await response.text()}")
-                else:
-                    print("✅ Successfully pushed payload file to Discord!")
+        # 1. Send the Dashboard Embed first
+        response = session.post(webhook_url, data=orjson.dumps(data), headers={"Content-Type": "application/json"}, timeout=30)
+        if response.status_code not in (200, 204):
+            print(f"Failed to send dashboard to Discord. Status: {response.status_code}, text: {response.text}")
+        else:
+            print("✅ Successfully pushed dashboard report to Discord!")
+        
+        # Small delay to guarantee ordering
+        time.sleep(1)
+        
+        # 2. Send the actual file in a separate message (plain text previews inline in Discord)
+        payload = optimized_text.encode('utf-8')
+        attachment = (file_name, payload, 'text/plain')
+        if len(payload) > DISCORD_MAX_UPLOAD_BYTES:
+            attachment = (f"{file_name}.gz", gzip.compress(payload, compresslevel=6), 'application/gzip')
+        response = session.post(
+            webhook_url,
+            data={'content': "📦 **Distilled Payload Attachment:**"},
+            files={'file': attachment},
+            timeout=60
+        )
+        if response.status_code not in (200, 204):
+            print(f"Failed to send file to Discord. Status: {response.status_code}, text: {response.text}")
+        else:
+            print("✅ Successfully pushed payload file to Discord!")
     except Exception as e:
         print(f"Error sending to discord: {e}")
 
 
-def run_extraction(target_date_str, api_preference, target_model, webhook_url):
+def run_extraction(target_date_str, api_preference, target_model, webhook_url, use_cache=False, resume=False):
     print("Initializing Database & Keys via Infisical...")
     
     # 1. Fetch Secrets
@@ -503,23 +760,32 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
                  client_secret=inf_client_secret
              )
 
-        news_url = infisical.secrets.get_secret_by_name(secret_name="turso_emadarshadalam_newsdatabase_db_url", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
-        news_token = infisical.secrets.get_secret_by_name(secret_name="turso_emadarshadalam_newsdatabase_auth_token", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
+        def fetch_secret(name):
+            return infisical.secrets.get_secret_by_name(secret_name=name, project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
+
+        # Independent lookups: fetched concurrently so startup costs ~1 round-trip, not 7
+        with ThreadPoolExecutor(max_workers=7) as pool:
+            required = [pool.submit(fetch_secret, name) for name in (
+                "turso_emadarshadalam_newsdatabase_db_url",
+                "turso_emadarshadalam_newsdatabase_auth_token",
+                "turso_emadprograms_analystworkbench_db_url",
+                "turso_emadprograms_analystworkbench_auth_token",
+            )]
+            webhook_future = pool.submit(fetch_secret, "discord_captain_clean_news_webhook_url")
+            # Gmail Secrets for Stock Analysis Integration
+            gmail_futures = [pool.submit(fetch_secret, name) for name in ("arshademad_gmail_address", "google_news_network_app_password")]
 
-        km_url = infisical.secrets.get_secret_by_name(secret_name="turso_emadprograms_analystworkbench_db_url", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
-        km_token = infisical.secrets.get_secret_by_name(secret_name="turso_emadprograms_analystworkbench_auth_token", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
+        news_url, news_token, km_url, km_token = [f.result() for f in required]
 
         try:
-            inf_webhook = infisical.secrets.get_secret_by_name(secret_name="discord_captain_clean_news_webhook_url", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
+            inf_webhook = webhook_future.result()
             if inf_webhook and not webhook_url:
                 webhook_url = inf_webhook
         except Exception:
             pass
 
-        # Fetch Gmail Secrets for Stock Analysis Integration
         try:
-            gmail_user = infisical.secrets.get_secret_by_name(secret_name="arshademad_gmail_address", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
-            gmail_pass = infisical.secrets.get_secret_by_name(secret_name="google_news_network_app_password", project_id=inf_project_id, environment_slug="dev", secret_path="/").secretValue
+            gmail_user, gmail_pass = [f.result() for f in gmail_futures]
         except Exception:
             gmail_user = None
             gmail_pass = None
@@ -532,13 +798,16 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
     # 2. Init Clients
     db = NewsDatabase(news_url.replace("libsql://", "https://"), news_token)
     km = KeyManager(km_url, km_token)
-    ai_client = GeminiClient(km)
+    ai_client = GeminiClient(km, response_cache=ResponseCache() if use_cache else None)
 
     # 3. Determine Date
+    # One clock read for the whole run: the lookback cutoff and the report timestamp describe the same instant
+    now_utc = datetime.datetime.now(datetime.timezone.utc)
+    now_naive = now_utc.replace(tzinfo=None)
+    now_iso = now_utc.isoformat()
     if target_date_str:
         raw_date = datetime.datetime.strptime(target_date_str, "%Y-%m-%d").date()
     else:
-        now_utc = datetime.datetime.now(datetime.timezone.utc)
         raw_date = MarketCalendar.get_trading_session_date(now_utc)
     
     # Resolve to actual logical trading day (handles weekends/holidays → next trading day)
@@ -549,7 +818,6 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
         print(f"ℹ️  Input date {raw_date} is not a trading day. Resolved to logical session: {session_date}")
         
     session_start, session_end = MarketCalendar.get_session_window(session_date)
-    now_naive = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
     if session_start <= now_naive < session_end:
         session_end = now_naive
         
@@ -561,11 +829,11 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
     
     if not items:
         print("No items found. Aborting extraction.")
-        asyncio.run(send_discord_report(webhook_url, "No items found.", "No items to analyze.", f"{session_date}_network.log", [{
+        send_discord_report(ai_client.session, webhook_url, "No items found.", "No items to analyze.", f"{session_date}_network.log", [{
             "title": "⚠️ News Network: No Data",
             "description": f"No data found for the logical session: `{session_date}`.",
             "color": 16753920
-        }]))
+        }])
         return
 
     # 4. Email Extraction (Async check for the session date email)
@@ -574,37 +842,66 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
     if gmail_user and gmail_pass:
         stock_analysis_content, email_status = fetch_stock_analysis_email(gmail_user, gmail_pass, session_date)
 
-    preview_text = f"TOTAL NEWS QUANTITY: {len(items)}\n=== START RAW DATA DUMP ===\n\n"
+    preview_parts = [f"TOTAL NEWS QUANTITY: {len(items)}\n=== START RAW DATA DUMP ===\n\n"]
     for idx, item in enumerate(items):
         t = item.get('time', 'N/A')
         title = item.get('title', 'No Title')
-        body = " ".join(clean_content(item.get('content', [])))
-        preview_text += f"ITEM {idx+1}:\n[{t}] {title}\n{body}\n\n"
+        body = get_item_body(item)
+        preview_parts.append(f"ITEM {idx+1}:\n[{t}] {title}\n{body}\n\n")
 
-    raw_input_tokens = km.estimate_tokens(preview_text)
-    chunks = chunk_data(items, max_tokens=10000)
+    # Only the size of the raw dump is needed here (it is never sent), so skip joining it
+    raw_input_tokens = km.estimate_tokens_batch(preview_parts)
+    chunks = chunk_data(items, max_tokens=km.get_chunk_budget(target_model))
     print(f"Chunked into {len(chunks)} parts.")
     
-    all_extracted_items = []
+    extracted_by_key = {} # (primary_entity, event_summary[:64]) -> item
     total_api_calls = 0
-    max_threads = min(len(chunks), 15)
+    
+    checkpoint_path = os.path.join(CHECKPOINT_DIR, f"{session_date}.jsonl")
+    done_chunks = load_checkpoints(checkpoint_path) if resume else {}
+    chunk_ids = [chunk_checkpoint_id(chunk, target_model) for chunk in chunks]
+    pending = []
+    for i, chunk in enumerate(chunks):
+        if chunk_ids[i] in done_chunks:
+            merge_news_items(extracted_by_key, done_chunks[chunk_ids[i]])
+        else:
+            pending.append(i)
+    if len(pending) < len(chunks):
+        print(f"Resuming from checkpoint: {len(chunks) - len(pending)}/{len(chunks)} parts already extracted.")
+    
+    max_threads = max(1, min(len(pending), MAX_CONCURRENT_REQUESTS))
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
     
     start_time = time.time()
 
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+    # Chunks go to the interactive endpoint on purpose: the configs are free-tier keys (no Batch API access)
+    # and a run is awaited by a Discord user, while batch jobs may take hours to complete.
+    failed_chunks = 0
+    with open(checkpoint_path, 'ab' if resume else 'wb') as checkpoint_file, ThreadPoolExecutor(max_workers=max_threads) as executor:
         future_to_chunk = {
-            executor.submit(extract_chunk_worker_cli, (i+1, chunk, len(chunks), target_model, 0, ai_client, km)): i 
-            for i, chunk in enumerate(chunks)
+            executor.submit(extract_chunk_in_slot_cli, (i+1, chunks[i], len(chunks), target_model, 0, ai_client, km)): i 
+            for i in pending
         }
         
         for future in as_completed(future_to_chunk):
             success, chunk_items, logs, calls = future.result()
             total_api_calls += calls
             if success:
-                all_extracted_items.extend(chunk_items)
-            for l in logs:
-                print(l)
+                # Written before merging: merge_news_items folds later duplicates into earlier items in place
+                checkpoint_file.write(orjson.dumps({"chunk_id": chunk_ids[future_to_chunk[future]], "items": chunk_items}) + b"\n")
+                checkpoint_file.flush()
+                merge_news_items(extracted_by_key, chunk_items)
+            else:
+                failed_chunks += 1
+            if logs:
+                print("\n".join(logs)) # one write per finished chunk instead of one per line
 
+    if failed_chunks:
+        print(f"⚠️ {failed_chunks} parts failed. Re-run with --resume to retry only those.")
+    else:
+        os.remove(checkpoint_path) # complete: the next run of this date extracts afresh
+
+    all_extracted_items = list(extracted_by_key.values())
     ext_duration = time.time() - start_time
     print(f"Extraction took {ext_duration:.1f}s, Yielded {len(all_extracted_items)} optimized features.")
     
@@ -621,25 +918,20 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
     original_headlines = [item.get('title', 'Unknown') for item in items]
     norm_original = {normalize_text(h): h for h in original_headlines}
     
-    extracted_sources = []
+    extracted_sources = set() # the same headline often backs several items: normalize it once
     for item in all_extracted_items:
         sources = item.get('source_headlines', [])
         if isinstance(sources, list):
-            extracted_sources.extend(sources)
+            extracted_sources.update(s for s in sources if isinstance(s, str))
     
     norm_extracted = {normalize_text(s) for s in extracted_sources}
     
     preserved_titles = []
     lost_titles = []
     
+    found_norms = match_headlines(norm_original, norm_extracted)
     for h_norm, original_title in norm_original.items():
-        is_found = False
-        for s_norm in norm_extracted:
-            if h_norm == s_norm or h_norm in s_norm or s_norm in h_norm:
-                is_found = True
-                break
-        
-        if is_found:
+        if h_norm in found_norms:
             preserved_titles.append(original_title)
         else:
             lost_titles.append(original_title)
@@ -697,7 +989,7 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
                 "inline": False
             }
         ],
-        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat()
+        "timestamp": now_iso
     }]
     
     if not stock_analysis_content:
@@ -715,7 +1007,8 @@ def run_extraction(target_date_str, api_preference, target_model, webhook_url):
              "fields": [{"name": "Items", "value": "\n".join([f"- {i}" for i in sorted(list(set(lost_titles)))])[:1000]}]
          })
 
-    asyncio.run(send_discord_report(webhook_url, "Report ready", optimized_text, f"{session_date}_news.log", embeds))
+    # Same keep-alive requests pool the extraction workers used (no second HTTP stack / event loop)
+    send_discord_report(ai_client.session, webhook_url, "Report ready", optimized_text, f"{session_date}_news.log", embeds)
 
 
 if __name__ == "__main__":
@@ -724,6 +1017,8 @@ if __name__ == "__main__":
     parser.add_argument("--api", type=str, help="Target API preference (gemini, deepseek, etc)", default="gemini")
     parser.add_argument("--model", type=str, help="Target Model Config name", default="gemini-3.1-flash-lite-free")
     parser.add_argument("--webhook", type=str, help="Discord Webhook URL", default=None)
+    parser.add_argument("--cache", action="store_true", help="Reuse cached LLM responses for identical prompts (local re-runs; off for scheduled runs)")
+    parser.add_argument("--resume", action="store_true", help="Skip parts already extracted by an interrupted run of the same date/model (checkpoints/)")
     
     args = parser.parse_args()
     
@@ -732,7 +1027,7 @@ if __name__ == "__main__":
         print("WARNING: No Discord Webhook URL provided. The log won't be sent.")
         
     print(f"Starting News Extraction: Date={args.date}, API={args.api}, Model={args.model}")
-    run_extraction(args.date, args.api, args.model, webhook_url)
+    run_extraction(args.date, args.api, args.model, webhook_url, use_cache=args.cache, resume=args.resume)
     
     print("🎬 Extraction complete. Shutting down.")
-    os._exit(0)  # 🔒 SAFETY NET: Force-kill to prevent zombie aiohttp/threads from blocking GitHub Actions
+    os._exit(0)  # 🔒 SAFETY NET: Force-kill to prevent zombie threads from blocking GitHub Actions
@@ -1,17 +1,90 @@
 import libsql_client
-from datetime import datetime
+from datetime import datetime, timezone, timedelta
 from dateutil import parser as dt_parser
 import modules.market_utils as market_utils
 
+BAHRAIN_TZ = timezone(timedelta(hours=3)) # UTC+3, display timezone for fetched news
+# Row times are formatted field-by-field: strftime re-parses its format string on every call
+_BAHRAIN_TZ_SUFFIX = datetime(2000, 1, 1, tzinfo=BAHRAIN_TZ).strftime("%Z%z") # what "%Z%z" renders for every row
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+def parse_published_at(value):
+    """ Stored timestamps are ISO from insertion: C-level fromisoformat first, dateutil only for other formats. """
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return dt_parser.parse(value)
+
+# (url, token) -> sync client. Repeat constructions reuse its HTTPS keep-alive pool instead of a fresh TLS handshake.
+_CLIENT_CACHE = {}
+_SCHEMA_CHECKED = set() # cache keys whose schema/migrations already ran in this process
+
+# Fixed query text, built once per process. libsql_client has no prepare() over HTTP,
+# so the closest thing to statement reuse is sending byte-identical SQL with bound params.
+_NEWS_COLUMNS = "title, url, content, published_at, source_domain, category, publisher"
+_SESSION_FILTER = "(trading_session_date = ? OR (trading_session_date IS NULL AND date(published_at) = ?))"
+
+SQL_INSERT_NEWS = """
+INSERT OR IGNORE INTO market_news 
+(published_at, title, url, source_domain, publisher, category, content, trading_session_date) 
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_NEWS_BY_DATE_CATEGORY = f"""
+SELECT {_NEWS_COLUMNS}
+FROM market_news 
+WHERE category = ? 
+AND {_SESSION_FILTER}
+AND category != 'HIDDEN'
+AND publisher != 'BLOCKED'
+ORDER BY published_at DESC
+"""
+SQL_NEWS_BY_DATE = f"""
+SELECT {_NEWS_COLUMNS}
+FROM market_news 
+WHERE {_SESSION_FILTER}
+AND category != 'HIDDEN'
+AND publisher != 'BLOCKED'
+ORDER BY published_at DESC
+"""
+SQL_RECENT_NEWS = f"""
+SELECT {_NEWS_COLUMNS}
+FROM market_news 
+ORDER BY published_at DESC
+LIMIT ?
+"""
+SQL_NEWS_RANGE = f"""
+SELECT {_NEWS_COLUMNS}
+FROM market_news 
+WHERE published_at >= ? AND published_at <= ?
+ORDER BY published_at DESC
+"""
+SQL_ID_BY_URL = "SELECT id FROM market_news WHERE url = ?"
+SQL_ID_BY_TITLE = "SELECT id FROM market_news WHERE title = ?"
+SQL_LAST_UPDATE = "SELECT MAX(created_at) FROM market_news"
+# Two disjoint branches: the ISO prefix branch is an idx_pub_date range search; the legacy
+# (non-ISO, Raw RSS) branch can't be expressed as a range and still scans the table.
+SQL_TITLES_FOR_DATE = """
+SELECT id, title, published_at FROM market_news WHERE published_at GLOB ?
+UNION ALL
+SELECT id, title, published_at FROM market_news WHERE published_at NOT GLOB '[0-9][0-9][0-9][0-9]-*'
+ORDER BY id
+"""
+
 class NewsDatabase:
+    INSERT_BATCH_SIZE = 500 # statements per batch() call, keeps each request well under the payload limit
+
     def __init__(self, db_url, db_token, init_schema=True):
         # Force HTTPS instead of WSS/LibSQL for stability
         self.url = db_url.replace("wss://", "https://").replace("libsql://", "https://")
         self.token = db_token
         try:
-            self.client = libsql_client.create_client_sync(url=self.url, auth_token=db_token)
-            if init_schema:
+            cache_key = (self.url, db_token)
+            self.client = _CLIENT_CACHE.get(cache_key)
+            if self.client is None:
+                self.client = _CLIENT_CACHE[cache_key] = libsql_client.create_client_sync(url=self.url, auth_token=db_token)
+            if init_schema and cache_key not in _SCHEMA_CHECKED:
                 self._initialize_db()
+                _SCHEMA_CHECKED.add(cache_key)
         except Exception as e:
             print(f"❌ DB Connect Error: {e}")
             self.client = None
@@ -75,6 +148,8 @@ class NewsDatabase:
             self.client.execute(sql_create)
             # Index on Category/Date for speed
             self.client.execute("CREATE INDEX IF NOT EXISTS idx_cat_date ON market_news(category, published_at);")
+            # published_at alone for prefix/range lookups that don't filter by category
+            self.client.execute("CREATE INDEX IF NOT EXISTS idx_pub_date ON market_news(published_at);")
         except Exception as e:
             print(f"❌ Schema Init Error: {e}")
 
@@ -142,12 +217,8 @@ class NewsDatabase:
         
         session_str = trading_session_date.strftime("%Y-%m-%d") if trading_session_date else None
         
-        sql = """
-        INSERT OR IGNORE INTO market_news 
-        (published_at, title, url, source_domain, publisher, category, content, trading_session_date) 
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        
+        stmts = []
+        batch_items = [] # news_list entries behind each statement, for per-row error messages
         for item in news_list:
             try:
                 # Prepare values
@@ -166,25 +237,32 @@ class NewsDatabase:
                 else:
                     content_str = str(content_list)
 
-                # Execute
-                rs = self.client.execute(sql, [pub_at, title, url, domain, publisher, item_cat, content_str, session_str])
-                
-                # Check if inserted (rows_affected)
-                # Libsql might return rowcount differently, but OR IGNORE usually means 0 rows if dupe
+                stmts.append(libsql_client.Statement(SQL_INSERT_NEWS, [pub_at, title, url, domain, publisher, item_cat, content_str, session_str]))
+                batch_items.append(item)
+            except Exception as e:
+                print(f"⚠️ Insert Error for {item.get('title')}: {e}")
+        
+        # 🚀 Batch Execute: one round-trip (and one implicit transaction) per sub-batch instead of per row
+        for i in range(0, len(stmts), self.INSERT_BATCH_SIZE):
+            batch = stmts[i:i + self.INSERT_BATCH_SIZE]
+            try:
+                results = self.client.batch(batch)
+            except Exception as e:
+                # The batch rolled back as a whole: retry row by row so one bad row only loses itself
+                print(f"⚠️ Batch Insert Error ({len(batch)} items), retrying individually: {e}")
+                results = []
+                for stmt, item in zip(batch, batch_items[i:i + self.INSERT_BATCH_SIZE]):
+                    try:
+                        results.append(self.client.execute(stmt))
+                    except Exception as row_err:
+                        print(f"⚠️ Insert Error for {item.get('title')}: {row_err}")
+            for rs in results:
+                # OR IGNORE means 0 rows affected if dupe
                 if rs.rows_affected > 0:
                     inserted += 1
                 else:
                     duplicates += 1
-                    
-            except Exception as e:
-                print(f"⚠️ Insert Error for {item.get('title')}: {e}")
-        
-        # 💾 EXPLICIT COMMIT (Crucial for Persistence)
-        try:
-            self.client.commit()
-        except:
-            pass # Sync client might auto-commit or not have method, but harmless to try
-            
+
         return inserted, duplicates
 
     def fetch_news_by_date(self, date_obj, category=None):
@@ -197,25 +275,10 @@ class NewsDatabase:
         target_date_str = date_obj.strftime("%Y-%m-%d")
         
         if category:
-            sql = """
-            SELECT title, url, content, published_at, source_domain, category, publisher
-            FROM market_news 
-            WHERE category = ? 
-            AND (trading_session_date = ? OR (trading_session_date IS NULL AND date(published_at) = ?))
-            AND category != 'HIDDEN'
-            AND publisher != 'BLOCKED'
-            ORDER BY published_at DESC
-            """
+            sql = SQL_NEWS_BY_DATE_CATEGORY
             params = [category, target_date_str, target_date_str]
         else:
-            sql = """
-            SELECT title, url, content, published_at, source_domain, category, publisher
-            FROM market_news 
-            WHERE (trading_session_date = ? OR (trading_session_date IS NULL AND date(published_at) = ?))
-            AND category != 'HIDDEN'
-            AND publisher != 'BLOCKED'
-            ORDER BY published_at DESC
-            """
+            sql = SQL_NEWS_BY_DATE
             params = [target_date_str, target_date_str]
         
         try:
@@ -230,14 +293,12 @@ class NewsDatabase:
                 
                 # Format time string for UI (HH:MM style)
                 try:
-                    # Robust parsing using dateutil
-                    dt = dt_parser.parse(row[3])
+                    dt = parse_published_at(row[3])
                     
                     # Convert to Bahrain Time (UTC+3)
-                    bahrain_tz = datetime.timezone(datetime.timedelta(hours=3))
-                    dt_local = dt.astimezone(bahrain_tz)
+                    dt_local = dt.astimezone(BAHRAIN_TZ)
                     
-                    time_str = dt_local.strftime("%H:%M %Z%z").strip()
+                    time_str = f"{dt_local.hour:02d}:{dt_local.minute:02d} {_BAHRAIN_TZ_SUFFIX}"
                 except:
                     time_str = "??:??"
 
@@ -272,41 +333,20 @@ class NewsDatabase:
     def fetch_existing_titles(self, date_obj):
         """ Returns a DICT of {normalized_title: id} for the given date for fast deduplication and auditing. """
         if not self.client: return {}
-        date_iso = date_obj.strftime("%Y-%m-%d")
+        target_iso = date_obj.strftime("%Y-%m-%d")
         try:
-
-            # We fetch ALL and filter in Python to handle mixed date formats (ISO vs Raw RSS)
-            sql = "SELECT id, title, published_at FROM market_news"
-            rs = self.client.execute(sql)
-            titles_map = {}
-            target_iso = date_obj.strftime("%Y-%m-%d")
+            # ISO rows are filtered by prefix in SQL (indexed); only non-ISO rows (Raw RSS dates) come back for Python parsing
+            rs = self.client.execute(SQL_TITLES_FOR_DATE, [f"{target_iso}*"])
+            matched = []
+            for row_id, t, pub_at in rs.rows:
+                if not pub_at.startswith(target_iso):
+                    try:
+                        if dt_parser.parse(pub_at).date() != date_obj: continue
+                    except:
+                        continue
+                matched.append((row_id, t))
             
-            for row in rs.rows:
-                row_id = row[0]
-                t = row[1]
-                pub_at = row[2]
-                
-                # Check Date Match (Robust)
-                try:
-                    # Try ISO string match First (Fast)
-                    if pub_at.startswith(target_iso):
-                        match = True
-                    else:
-                        # Fallback Parse
-                        dt = dt_parser.parse(pub_at)
-                        if dt.date() == date_obj:
-                            match = True
-                        else:
-                            match = False
-                except:
-                    match = False
-                
-                if match:
-                    # improved normalization
-                    norm_t = market_utils.normalize_title(t).lower()
-                    titles_map[norm_t] = row_id
-                
-            return titles_map
+            return {market_utils.normalize_title(t).lower(): row_id for row_id, t in matched}
         except Exception as e:
             print(f"⚠️ Fetch Existing Titles Error: {e}")
             return {}
@@ -350,29 +390,20 @@ class NewsDatabase:
         """
         if not self.client: return []
         
-        sql = """
-        SELECT title, url, content, published_at, source_domain, category, publisher
-        FROM market_news 
-        ORDER BY published_at DESC
-        LIMIT ?
-        """
-        
         try:
-            rs = self.client.execute(sql, [limit])
+            rs = self.client.execute(SQL_RECENT_NEWS, [limit])
             results = []
             for row in rs.rows:
                 content_str = row[2]
                 content_list = content_str.split("\n") if content_str else []
                 
                 try:
-                    # Robust parsing
-                    dt = dt_parser.parse(row[3])
+                    dt = parse_published_at(row[3])
                     
                     # Convert to Bahrain Time (UTC+3)
-                    bahrain_tz = datetime.timezone(datetime.timedelta(hours=3))
-                    dt_local = dt.astimezone(bahrain_tz)
+                    dt_local = dt.astimezone(BAHRAIN_TZ)
                     
-                    time_str = dt_local.strftime("%H:%M %d-%b")
+                    time_str = f"{dt_local.hour:02d}:{dt_local.minute:02d} {dt_local.day:02d}-{_MONTHS[dt_local.month - 1]}"
                 except:
                     time_str = "Unknown"
 
@@ -400,29 +431,20 @@ class NewsDatabase:
         """
         if not self.client: return []
         
-        sql = """
-        SELECT title, url, content, published_at, source_domain, category, publisher
-        FROM market_news 
-        WHERE published_at >= ? AND published_at <= ?
-        ORDER BY published_at DESC
-        """
-        
         try:
-            rs = self.client.execute(sql, [start_iso, end_iso])
+            rs = self.client.execute(SQL_NEWS_RANGE, [start_iso, end_iso])
             results = []
             for row in rs.rows:
                 content_str = row[2]
                 content_list = content_str.split("\n") if content_str else []
                 
                 try:
-                    # Robust Parsing
-                    dt = dt_parser.parse(row[3])
+                    dt = parse_published_at(row[3])
                     
                     # Convert to Bahrain Time (UTC+3)
-                    bahrain_tz = datetime.timezone(datetime.timedelta(hours=3))
-                    dt_local = dt.astimezone(bahrain_tz)
+                    dt_local = dt.astimezone(BAHRAIN_TZ)
                     
-                    time_str = dt_local.strftime("%H:%M %d-%b")
+                    time_str = f"{dt_local.hour:02d}:{dt_local.minute:02d} {dt_local.day:02d}-{_MONTHS[dt_local.month - 1]}"
                 except:
                     time_str = "Unknown"
 
@@ -524,22 +546,15 @@ class NewsDatabase:
         
         try:
             # Check URL first (Fast, Indexed)
-            sql = "SELECT id FROM market_news WHERE url = ?"
-            rs = self.client.execute(sql, [url])
-            if rs.rows: 
-                print(f"    ✅ MATCH FOUND by URL: {url}")
-                return rs.rows[0][0]
+            rs = self.client.execute(SQL_ID_BY_URL, [url])
+            if rs.rows: return rs.rows[0][0]
             
             # Check Title (slower, but catches URL variations)
             if title:
                 # Use simplified normalization check if possible, but exact match for now
-                sql_t = "SELECT id FROM market_news WHERE title = ?"
-                rs_t = self.client.execute(sql_t, [title])
-                if rs_t.rows: 
-                    print(f"    ✅ MATCH FOUND by Title: {title}")
-                    return rs_t.rows[0][0]
+                rs_t = self.client.execute(SQL_ID_BY_TITLE, [title])
+                if rs_t.rows: return rs_t.rows[0][0]
             
-            print(f"    ❌ NO MATCH for: {url} OR {title}")
             return False
         except Exception as e:
             print(f"⚠️ Existence Check Error: {e}")
@@ -548,7 +563,7 @@ class NewsDatabase:
     def get_last_update_time(self):
         """ Returns the timestamp of the most recently added news item. """
         try:
-            rs = self.client.execute("SELECT MAX(created_at) FROM market_news")
+            rs = self.client.execute(SQL_LAST_UPDATE)
             if rs.rows and rs.rows[0][0]:
                 return rs.rows[0][0]
             return None
@@ -7,10 +7,19 @@ import hashlib
 import libsql_client
 import traceback
 import requests
-import json
+from requests.adapters import HTTPAdapter
+import orjson
 
 log = logging.getLogger(__name__)
 
+# Max in-flight Gemini requests (re-exported by llm_client). Extraction executors size their thread pools
+# from this, and both keep-alive pools are sized to match so no connection is discarded under full load.
+MAX_CONCURRENT_REQUESTS = 15
+
+# Keep-alive pool for the raw pipeline writes (one report_usage per Gemini call, from every worker thread)
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_maxsize=MAX_CONCURRENT_REQUESTS))
+
 # --- TABLE 1: KEYS ---
 CREATE_KEYS_TABLE_SQL = """
 CREATE TABLE IF NOT EXISTS gemini_api_keys (
@@ -168,6 +177,8 @@ class KeyManager:
     }
 
     COOLDOWN_PERIODS = {1: 10, 2: 60, 3: 300, 4: 3600} 
+    CHUNK_TOKEN_BUDGET = 10000 # Input tokens per extraction chunk (output is capped at 8192)
+    CHARS_PER_TOKEN = 2.5 # Token heuristic shared by quota accounting and chunk packing
     MAX_STRIKES = 5
     FATAL_STRIKE_COUNT = 999
 
@@ -273,11 +284,31 @@ class KeyManager:
     @staticmethod
     def estimate_tokens(text: str) -> int:
         """
-        Rough Token Estimation (1 token ~= 4 chars).
+        Rough Token Estimation (1 token ~= CHARS_PER_TOKEN chars).
         Use this BEFORE calling get_key to ensure the request fits in the chosen bucket.
         """
         if not text: return 0
-        return int(len(text) / 2.5) + 1
+        return int(len(text) / KeyManager.CHARS_PER_TOKEN) + 1
+
+    @staticmethod
+    def estimate_tokens_batch(texts) -> int:
+        """
+        Same estimate as estimate_tokens("".join(texts)), without materializing the joined string.
+        """
+        total_chars = sum(len(t) for t in texts)
+        if not total_chars: return 0
+        return int(total_chars / KeyManager.CHARS_PER_TOKEN) + 1
+
+    def get_chunk_budget(self, config_id: str) -> int:
+        """
+        Input-token budget for one extraction chunk on config_id.
+        Low-TPM models (Gemma: 15k/min) get a smaller budget so chunk + prompt scaffold
+        never approaches the per-minute limit. Long-context models do not get a larger one:
+        the 8192-token output cap, not the context window, bounds how much a chunk can yield.
+        """
+        config = self.MODELS_CONFIG.get(config_id)
+        if not config: return self.CHUNK_TOKEN_BUDGET
+        return min(self.CHUNK_TOKEN_BUDGET, config['limits']['tpm'] // 2)
 
     def get_key(self, config_id: str, estimated_tokens: int = 0) -> tuple[str | None, str | None, float, str | None]:
         """
@@ -452,7 +483,7 @@ class KeyManager:
         payload = {"requests": [{"type": "execute", "stmt": {"sql": sql, "args": encoded_args}}]}
         
         try:
-            resp = requests.post(url, json=payload, headers=headers, timeout=5)
+            resp = _http_session.post(url, data=orjson.dumps(payload), headers=headers, timeout=5)
             if resp.status_code != 200:
                 msg = f"Raw DB Exec Failed: {resp.status_code} {resp.text}"
                 log.error(msg)
@@ -1,20 +1,55 @@
 import time
+import threading
 import requests
+import orjson
 import logging
-from modules.key_manager import KeyManager
+from requests.adapters import HTTPAdapter
+from modules.key_manager import KeyManager, MAX_CONCURRENT_REQUESTS
 
 log = logging.getLogger(__name__)
 
+# Upper bound on a single quota wait. KeyManager reports seconds until the first key frees up
+# (up to 60s for RPM/TPM windows, an hour for exhausted daily quotas).
+MAX_QUOTA_WAIT = 60
+
+# Process-wide extraction worker slots. Top-level chunk workers hold one each; a branch split only
+# gets its own thread for the second half when a slot is free, so nested splits never push in-flight
+# requests past MAX_CONCURRENT_REQUESTS (HTTP pool size, free-tier concurrency).
+REQUEST_SLOTS = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+# Shared keep-alive pool: TLS connections are reused across worker threads,
+# GeminiClient instances and Streamlit reruns.
+_http_session = requests.Session()
+_http_session.mount("https://", HTTPAdapter(pool_connections=MAX_CONCURRENT_REQUESTS, pool_maxsize=MAX_CONCURRENT_REQUESTS))
+
+# Enforce JSON generation and max tokens (identical for every model/request)
+_GENERATION_CONFIG = {
+    "maxOutputTokens": 8192,
+    "temperature": 0.1,
+    "responseMimeType": "application/json"
+}
+
 class GeminiClient:
     """
     Client for Google Gemini API using KeyManager for rate limiting and rotation.
     """
-    def __init__(self, key_manager: KeyManager):
+    def __init__(self, key_manager: KeyManager, response_cache=None):
         self.key_manager = key_manager
+        self.session = _http_session
+        self.response_cache = response_cache  # optional ResponseCache (local re-runs)
 
-    def generate_content(self, prompt: str, config_id: str = 'gemini-3.1-flash-lite-free') -> dict:
+    def cache_response(self, prompt: str, config_id: str, content: str):
+        """
+        Stores a response the caller has validated (parsed and accepted). generate_content only
+        reads the cache, so answers the caller rejects are never replayed on retries or re-runs.
+        """
+        if self.response_cache:
+            self.response_cache.set(config_id, prompt, content)
+
+    def generate_content(self, prompt: str, config_id: str = 'gemini-3.1-flash-lite-free', est_tokens: int = None) -> dict:
         """
         Generates content using the specified model configuration.
+        Pass est_tokens when the caller already estimated the prompt (e.g. across retries).
         
         Returns:
             dict: {
@@ -24,8 +59,20 @@ class GeminiClient:
                 "key_name": str
             }
         """
+        # 0. Identical prompt already answered (only when a response cache is configured)
+        if self.response_cache:
+            cached = self.response_cache.get(config_id, prompt)
+            if cached is not None:
+                return {
+                    "success": True,
+                    "content": cached,
+                    "model_used": config_id,
+                    "key_name": "cache"
+                }
+        
         # 1. Estimate Tokens
-        est_tokens = self.key_manager.estimate_tokens(prompt)
+        if est_tokens is None:
+            est_tokens = self.key_manager.estimate_tokens(prompt)
         
         # 2. Get Key
         key_name, key_value, wait_time, model_id = self.key_manager.get_key(config_id, est_tokens)
@@ -59,23 +106,18 @@ class GeminiClient:
         url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_id}:generateContent?key={key_value}"
         headers = {'Content-Type': 'application/json'}
         
-        # Enforce JSON generation and max tokens
         payload = {
             "contents": [{
                 "parts": [{"text": prompt}]
             }],
-            "generationConfig": {
-                "maxOutputTokens": 8192,
-                "temperature": 0.1,
-                "responseMimeType": "application/json"
-            }
+            "generationConfig": _GENERATION_CONFIG
         }
         
         try:
-            response = requests.post(url, json=payload, headers=headers, timeout=300)
+            response = self.session.post(url, data=orjson.dumps(payload), headers=headers, timeout=300)
             
             if response.status_code == 200:
-                data = response.json()
+                data = orjson.loads(response.content)
                 
                 # Check for candidates and safety filters
                 candidates = data.get('candidates', [])
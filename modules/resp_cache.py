@@ -0,0 +1,43 @@
+import os
+import time
+import hashlib
+import logging
+
+log = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    On-disk cache of successful LLM responses, keyed by (config_id, prompt).
+    One file per entry, so concurrent worker threads never share a write.
+    """
+    DEFAULT_TTL = 7 * 86400  # seconds
+
+    def __init__(self, directory: str = os.path.join(".cache", "llm"), ttl: int = DEFAULT_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, config_id: str, prompt: str) -> str:
+        digest = hashlib.blake2b(f"{config_id}\0{prompt}".encode(), digest_size=20).hexdigest()
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    def get(self, config_id: str, prompt: str):
+        """Cached response text, or None if missing or older than the TTL."""
+        path = self._path(config_id, prompt)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, config_id: str, prompt: str, content: str):
+        path = self._path(config_id, prompt)
+        tmp_path = f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(content)
+            os.replace(tmp_path, path)  # atomic: readers never see a partial entry
+        except OSError as e:
+            log.warning(f"Response cache write failed: {e}")
@@ -1,6 +1,32 @@
 import json
 from collections import defaultdict
 
+def merge_news_items(seen: dict, items: list) -> None:
+    """
+    Adds extracted items into `seen`, deduplicating across chunks.
+    
+    Items are keyed on (primary_entity, first 64 chars of event_summary). A duplicate
+    is dropped, but its source_headlines are folded into the kept item so headline
+    fidelity tracking still sees them. Items without an event_summary have nothing to
+    compare on and are kept as-is; non-dict entries from the LLM are skipped.
+    
+    Args:
+        seen (dict): Accumulator, materialize with list(seen.values()).
+        items (list): News item dictionaries from one chunk.
+    """
+    for item in items:
+        if not isinstance(item, dict): continue
+        summary = item.get('event_summary')
+        if not summary:
+            seen[object()] = item # unique key: never merged
+            continue
+        key = (str(item.get('primary_entity') or ''), str(summary)[:64]) # str(): the LLM sometimes returns a list
+        kept = seen.setdefault(key, item)
+        if kept is not item and item.get('source_headlines'):
+            headlines = list(kept.get('source_headlines') or [])
+            headlines.extend(h for h in item['source_headlines'] if h not in headlines)
+            kept['source_headlines'] = headlines
+
 def optimize_json_for_synthesis(json_data: list) -> str:
     """
     Groups news items by Entity and formats them into a dense, token-optimized plaintext.
@@ -2,13 +2,19 @@ import streamlit as st
 import time
 import datetime
 import re
+from html import unescape
+from bisect import bisect_right
+from itertools import accumulate, groupby
+from functools import lru_cache
 from modules.market_utils import MarketCalendar
 from modules.db_client import NewsDatabase
 from modules.key_manager import KeyManager
-from modules.llm_client import GeminiClient
-from modules.text_optimizer import optimize_json_for_synthesis
+from modules.llm_client import GeminiClient, MAX_CONCURRENT_REQUESTS, MAX_QUOTA_WAIT, REQUEST_SLOTS
+from modules.text_optimizer import optimize_json_for_synthesis, merge_news_items
 from infisical_sdk import InfisicalSDKClient
 import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # --- CONFIG ---
 st.set_page_config(page_title="News Network", page_icon="📰", layout="wide")
@@ -22,6 +28,11 @@ if 'data_loaded' not in st.session_state:
     st.session_state['data_loaded'] = False
 if 'dry_run_prompts' not in st.session_state: 
     st.session_state['dry_run_prompts'] = []
+if 'extraction_results' not in st.session_state:
+    st.session_state['extraction_results'] = None
+if 'executor' not in st.session_state:
+    # Persistent worker pool: threads survive across submits instead of being rebuilt per run
+    st.session_state['executor'] = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS)
 
 # --- CUSTOM CSS ---
 st.markdown("""
@@ -47,35 +58,24 @@ def get_db_connection():
             client_secret=infisical_secrets["client_secret"]
         )
         
-        # 1. News Database (Headed for data)
-        news_url = infisical.secrets.get_secret_by_name(
-            secret_name="turso_emadarshadalam_newsdatabase_db_url",
-            project_id=infisical_secrets["project_id"],
-            environment_slug="dev",
-            secret_path="/"
-        ).secretValue
+        def fetch_secret(name):
+            return infisical.secrets.get_secret_by_name(
+                secret_name=name,
+                project_id=infisical_secrets["project_id"],
+                environment_slug="dev",
+                secret_path="/"
+            ).secretValue
         
-        news_token = infisical.secrets.get_secret_by_name(
-            secret_name="turso_emadarshadalam_newsdatabase_auth_token",
-            project_id=infisical_secrets["project_id"],
-            environment_slug="dev",
-            secret_path="/"
-        ).secretValue
-
-        # --- 2. Key Manager Database (Headed for keys) ---
-        km_url = infisical.secrets.get_secret_by_name(
-            secret_name="turso_emadprograms_analystworkbench_db_url",
-            project_id=infisical_secrets["project_id"],
-            environment_slug="dev",
-            secret_path="/"
-        ).secretValue
-        
-        km_token = infisical.secrets.get_secret_by_name(
-            secret_name="turso_emadprograms_analystworkbench_auth_token",
-            project_id=infisical_secrets["project_id"],
-            environment_slug="dev",
-            secret_path="/"
-        ).secretValue
+        # Independent lookups: fetched concurrently so a cold start costs ~1 round-trip, not 4
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            news_url, news_token, km_url, km_token = pool.map(fetch_secret, [
+                # 1. News Database (Headed for data)
+                "turso_emadarshadalam_newsdatabase_db_url",
+                "turso_emadarshadalam_newsdatabase_auth_token",
+                # 2. Key Manager Database (Headed for keys)
+                "turso_emadprograms_analystworkbench_db_url",
+                "turso_emadprograms_analystworkbench_auth_token",
+            ])
         
         db = NewsDatabase(
             news_url.replace("libsql://", "https://"),
@@ -89,136 +89,250 @@ def get_db_connection():
 
 db, db_url, db_token = get_db_connection()
 
+@st.cache_resource
+def get_ai_clients(km_url, km_token):
+    """Builds the KeyManager/GeminiClient pair once (schema check + key load) instead of on every rerun."""
+    km = KeyManager(km_url, km_token)
+    return km, GeminiClient(km)
+
 if db_url and db_token:
-    km = KeyManager(db_url, db_token)
-    ai_client = GeminiClient(km)
+    km, ai_client = get_ai_clients(db_url, db_token)
 else:
     km = None
     ai_client = None
 
+RAW_PREVIEW_MAX_CHARS = 500_000
+LOST_TITLES_PAGE_SIZE = 50
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_news_cached(start_iso, end_iso):
+    """Memoized news fetch keyed on the ISO time window (resubmits skip the DB round-trip)."""
+    items = db.fetch_news_range(start_iso, end_iso)
+    # Clean bodies here so they are stored with the cached rows and cache hits skip cleaning
+    for item in items:
+        get_item_body(item)
+    return items
+
+def items_fingerprint(items):
+    """Cheap identity for a fetched item list: count plus first/last url and title."""
+    if not items: return (0,)
+    first, last = items[0], items[-1]
+    return (len(items), first.get('url'), first.get('title'), last.get('url'), last.get('title'))
+
+@st.cache_data(ttl=300, show_spinner=False)
+def build_raw_dump_cached(start_iso, end_iso, items_key, _items):
+    """Raw data backup text for the given items (keyed on window + items_fingerprint; _items is not hashed)."""
+    items = _items
+    preview_parts = [f"TOTAL NEWS QUANTITY: {len(items)}\n", "=== START RAW DATA DUMP ===\n\n"]
+    
+    for idx, item in enumerate(items):
+        t = item.get('time', 'N/A')
+        title = item.get('title', 'No Title')
+        body = get_item_body(item)
+        preview_parts.append(f"ITEM {idx+1}:\n[{t}] {title}\n{body}\n\n")
+    
+    preview_parts.append("=== END RAW DATA DUMP ===")
+    return "".join(preview_parts)
+
+
+_RE_NON_ALNUM = re.compile(r'[^a-z0-9\s]')
+# ASCII fast path for normalize_text: the bytes _RE_NON_ALNUM would remove from ASCII text
+_ASCII_NON_ALNUM_BYTES = bytes(
+    c for c in range(128) if not (chr(c).isspace() or chr(c) in 'abcdefghijklmnopqrstuvwxyz0123456789')
+)
 
 def normalize_text(text):
     """Global utility for consistent headline matching (keeps spaces)."""
     if not text: return ""
+    # LLM output may put non-strings in source_headlines; the cache needs hashable str keys
+    return _normalize_str(text if isinstance(text, str) else str(text))
+
+@lru_cache(maxsize=65536)
+def _normalize_str(text):
+    """Memoized body of normalize_text: the same headlines recur across retries, branches and the fidelity check."""
     # Lowercase, remove special chars except spaces
-    return re.sub(r'[^a-z0-9\s]', '', str(text).lower()).strip()
+    text = text.lower()
+    if text.isascii():
+        return text.encode().translate(None, _ASCII_NON_ALNUM_BYTES).decode().strip()
+    return _RE_NON_ALNUM.sub('', text).strip()
+
+def title_token_sets(chunk):
+    """Normalized title token sets for a chunk (computed once per worker, reused across retries)."""
+    return [set(normalize_text(item.get('title', 'Unknown')).split()) for item in chunk]
 
-def find_missing_items(chunk, salvaged_items):
+def build_headline_index(salvaged_items):
+    """Inverted index token -> ids of extracted headlines containing it."""
+    index = {}
+    headline_id = 0
+    for item in salvaged_items:
+        for h in item.get('source_headlines', []):
+            norm = normalize_text(h)
+            if norm:
+                for token in set(norm.split()):
+                    index.setdefault(token, []).append(headline_id)
+                headline_id += 1
+    return index
+
+def find_missing_items(chunk, salvaged_items, title_sets=None):
     """
     Identifies which original news items are missing from the salvaged list.
     Uses Token-Overlap Comparison (Strict Word Match).
     """
     if not salvaged_items: return chunk
+    if title_sets is None: title_sets = title_token_sets(chunk)
     
-    # Pre-calculate token sets for extracted headlines
-    extracted_sets = []
-    for item in salvaged_items:
-        for h in item.get('source_headlines', []):
-            norm = normalize_text(h)
-            if norm:
-                extracted_sets.append(set(norm.split()))
+    # Intersection sizes are counted through the inverted index, so only headlines sharing a word are visited
+    index = build_headline_index(salvaged_items)
     
     missing_items = []
-    for item in chunk:
-        title = item.get('title', 'Unknown')
-        norm_title = normalize_text(title)
-        if not norm_title:
+    for item, title_tokens in zip(chunk, title_sets):
+        if not title_tokens:
             missing_items.append(item)
             continue
-            
-        title_tokens = set(norm_title.split())
-        is_found = False
         
-        for e_tokens in extracted_sets:
-            # Use Token Intersection Ratio (Jaccard-ish)
-            # Story is 'found' if at least 85% of its title words are in an extracted headline
-            if not title_tokens: continue
-            intersection = title_tokens.intersection(e_tokens)
-            overlap = len(intersection) / len(title_tokens)
-            if overlap >= 0.85:
-                is_found = True
-                break
-                
-        if not is_found:
+        shared = {}
+        for token in title_tokens:
+            for headline_id in index.get(token, ()):
+                shared[headline_id] = shared.get(headline_id, 0) + 1
+        
+        # Story is 'found' if at least 85% of its title words are in an extracted headline (integer form of >= 0.85)
+        required = 17 * len(title_tokens)
+        if not any(count * 20 >= required for count in shared.values()):
             missing_items.append(item)
             
     return missing_items
 
 # --- HELPER FUNCTIONS ---
+def match_headlines(norm_headlines, norm_sources):
+    """Normalized headlines equal to, contained in, or containing some normalized source headline."""
+    if not norm_sources: return set()
+    # '\0' never survives normalize_text, so a match cannot straddle two joined strings
+    all_sources = "\0".join(norm_sources)
+    hits = {h for h in norm_headlines if h in norm_sources or h in all_sources}
+    
+    pending = [h for h in norm_headlines if h not in hits]
+    if pending:
+        all_pending = "\0".join(pending)
+        starts = [0, *accumulate(len(h) + 1 for h in pending)]
+        for s in norm_sources:
+            pos = all_pending.find(s)
+            while pos != -1:
+                idx = bisect_right(starts, pos) - 1
+                hits.add(pending[idx])
+                pos = all_pending.find(s, starts[idx + 1]) # one hit per headline is enough
+    return hits
+
+def strip_tags(text):
+    """Removes <...> tags in one str.find pass (same result as re.sub(r'<[^>]+>', '', text))."""
+    if '<' not in text: return text
+    out = []
+    i = 0
+    while True:
+        lt = text.find('<', i)
+        if lt < 0: break
+        gt = text.find('>', lt + 1)
+        if gt < 0: break
+        # "<>" is not a tag and stays in the text
+        out.append(text[i:gt + 1] if gt == lt + 1 else text[i:lt])
+        i = gt + 1
+    out.append(text[i:])
+    return "".join(out)
+
+def html_to_text(text):
+    """Tag-stripped text with HTML entities (&amp;, &#8217;, ...) decoded."""
+    text = strip_tags(text)
+    return unescape(text) if '&' in text else text
+
 def clean_content(content_list):
     """Cleans text list into pure paragraphs."""
     if not content_list: return []
-    full_text = " ".join(content_list)
-    clean_text = re.sub(r'<[^>]+>', '', full_text)
-    
     paragraphs = []
     if len(content_list) <= 1:
-        parts = clean_text.split(". ")
-        current_p = ""
-        for p in parts:
-            current_p += p + ". "
-            if len(current_p) > 200: 
-                paragraphs.append(current_p.strip())
-                current_p = ""
-        if current_p: paragraphs.append(current_p.strip())
+        clean_text = html_to_text(" ".join(c for c in content_list if c))
+        current = [] # sentences of the paragraph being built; joined once it passes 200 chars
+        current_len = 0
+        for p in clean_text.split(". "):
+            current.append(p)
+            current_len += len(p) + 2
+            if current_len > 200: 
+                paragraphs.append((". ".join(current) + ". ").strip())
+                current, current_len = [], 0
+        if current: paragraphs.append((". ".join(current) + ". ").strip())
     else:
-        paragraphs = [re.sub(r'<[^>]+>', '', c).strip() for c in content_list if c.strip()]
+        paragraphs = [html_to_text(c).strip() for c in content_list if c and c.strip()]
     return paragraphs
 
-def chunk_data(items, max_tokens=10000): # Aggressive Stability: 10k
+def get_item_body(item):
+    """Cleaned body text for an item, memoized on the item dict under '_body'."""
+    body = item.get('_body')
+    if body is None:
+        body = item['_body'] = " ".join(clean_content(item.get('content', [])))
+    return body
+
+def estimate_item_tokens(item, body):
+    """Token estimate for one packed item: body + 'time title publisher' line + fixed overhead."""
+    meta_len = len(str(item.get('time'))) + len(str(item.get('title'))) + len(str(item.get('publisher'))) + 2
+    return int((len(body) + meta_len + 50) / KeyManager.CHARS_PER_TOKEN)
+
+def chunk_data(items, max_tokens=KeyManager.CHUNK_TOKEN_BUDGET):
     """
     Splits items into chunks. 
     Intelligent Slicing: If an individual item exceeds the limit, it is sliced 
     into multiple parts to ensure zero data loss.
     """
     chunks = []
-    current_chunk = []
-    current_tokens = 0
     
     # Pre-process items to handle mega-stories (slicing instead of truncation)
     flat_items = []
-    limit_chars = int(max_tokens * 2.5)
+    item_tokens = [] # per flat item, estimated in the same pass
+    limit_chars = int(max_tokens * KeyManager.CHARS_PER_TOKEN)
     
     for item in items:
-        body = " ".join(clean_content(item.get('content', [])))
+        body = get_item_body(item)
         if len(body) > limit_chars:
             # Slice it
             parts = [body[i:i+limit_chars] for i in range(0, len(body), limit_chars)]
+            orig_title = item.get('title', 'No Title')
             for p_idx, p_text in enumerate(parts):
-                new_item = item.copy()
-                orig_title = item.get('title', 'No Title')
-                new_item['title'] = f"[Part {p_idx+1}/{len(parts)}] {orig_title}"
-                new_item['content'] = [p_text]
-                flat_items.append(new_item)
+                # Slim record, not item.copy(): only the fields prompts, token estimates and checkpoint ids read
+                part = {
+                    'time': item.get('time'),
+                    'title': f"[Part {p_idx+1}/{len(parts)}] {orig_title}",
+                    'publisher': item.get('publisher'),
+                    'content': [p_text],
+                    '_body': p_text # already cleaned, skip re-cleaning downstream
+                }
+                flat_items.append(part)
+                item_tokens.append(estimate_item_tokens(part, p_text))
         else:
             flat_items.append(item)
+            item_tokens.append(estimate_item_tokens(item, body))
 
-    # Now aggregate into chunks
-    for item in flat_items:
-        body = " ".join(clean_content(item.get('content', [])))
-        meta = f"{item.get('time')} {item.get('title')} {item.get('publisher')}"
-        total_chars = len(body) + len(meta) + 50 
-        est_tok = int(total_chars / 2.5)
-        
-        if (current_tokens + est_tok) > max_tokens and current_chunk:
-            chunks.append(current_chunk)
-            current_chunk = []
-            current_tokens = 0
-            
-        current_chunk.append(item)
-        current_tokens += est_tok
-        
-    if current_chunk:
-        chunks.append(current_chunk)
+    # Now aggregate into chunks: greedy packing via prefix sums + bisection
+    cum_tokens = list(accumulate(item_tokens))
+    start = 0
+    while start < len(flat_items):
+        base = cum_tokens[start - 1] if start else 0
+        # Always take at least one item, even if it alone exceeds the budget
+        end = max(bisect_right(cum_tokens, base + max_tokens, lo=start), start + 1)
+        chunks.append(flat_items[start:end])
+        start = end
         
     return chunks
 
-def build_chunk_prompt(chunk, index, total, market_data_text, headline_inventory):
-    """
-    STRICT DATA ETL PROMPT - V2
-    Includes Headline Inventory for Data Integrity Tracking.
-    """
-    prompt = f"""SYSTEM NOTICE: This is PART {index} of {total}.
+def build_chunk_context(chunk):
+    """Builds the (market_data_text, headline_inventory) pair consumed by build_chunk_prompt."""
+    headline_parts = []
+    context_parts = []
+    for idx, item in enumerate(chunk, 1):
+        t = item.get('time', 'N/A')
+        title = item.get('title', 'No Title')
+        body = get_item_body(item)
+        headline_parts.append(f"- {title}\n")
+        context_parts.append(f"--- SOURCE {idx} ---\nTITLE: {title}\nTIME: {t}\nCONTENT: {body}\n\n")
+    return "".join(context_parts), "".join(headline_parts)
+
+_CHUNK_PROMPT_TEMPLATE = """SYSTEM NOTICE: This is PART {index} of {total}.
 
 *** ROLE ***
 You are a high-fidelity Data Extraction Engine. Your sole purpose is to convert unstructured news text into a structured, machine-readable JSON dataset.
@@ -260,62 +374,192 @@ Output a valid JSON object with the following schema:
 === MARKET DATA STARTS BELOW ===
 {market_data_text}
 """
-    return prompt
+
+# Static prompt text around the four substitutions, split once at import
+(_PROMPT_HEAD, _PROMPT_AFTER_INDEX, _PROMPT_AFTER_TOTAL,
+ _PROMPT_AFTER_INVENTORY, _PROMPT_TAIL) = _CHUNK_PROMPT_TEMPLATE.format(
+    index='\0', total='\0', headline_inventory='\0', market_data_text='\0'
+).split('\0')
+
+# Appended once to the prompt after an unparseable reply, before falling back to residual/branch splitting
+_SCHEMA_REMINDER = "\n\nREMINDER: Your previous reply was not valid JSON. Return ONLY a valid JSON object matching the OUTPUT FORMAT schema above, starting with '{' and ending with '}'."
+
+def build_chunk_prompt(chunk, index, total, market_data_text, headline_inventory):
+    """
+    STRICT DATA ETL PROMPT - V2
+    Includes Headline Inventory for Data Integrity Tracking.
+    """
+    return f"{_PROMPT_HEAD}{index}{_PROMPT_AFTER_INDEX}{total}{_PROMPT_AFTER_TOTAL}{headline_inventory}{_PROMPT_AFTER_INVENTORY}{market_data_text}{_PROMPT_TAIL}"
+
+_RE_OBJ_GAP = re.compile(r'\}\s*\{')
+_RE_ARR_GAP = re.compile(r'\]\s*\[')
+_RE_TRAIL_COMMA_OBJ = re.compile(r',\s*\}')
+_RE_TRAIL_COMMA_ARR = re.compile(r',\s*\]')
+# [^\S\n]* stops at the first newline, so whitespace runs are not re-split while backtracking
+_RE_KV_NEWLINE = re.compile(r'\"[^\S\n]*\n\s*\"')
+# (?<!\d): don't restart \d+ inside a digit run (quadratic on long numbers)
+_RE_LITERAL_NEWLINE = re.compile(r'((?<!\d)\d+|true|false|null)[^\S\n]*\n\s*\"')
+_RE_MISSING_COLON = re.compile(r'\"([a-zA-Z0-9_]+)\"\s+\"([^\"]+)\"')
+_RE_SALVAGE_START = re.compile(r'\{\s*"category":')
+_RE_SALVAGE_TOKEN = re.compile(r'[{}"\\]')
+_RE_BRACE = re.compile(r'[{}]')
+_RE_JSON_STRUCT = re.compile(r'[{}\[\]"\\]')
 
 def repair_json_content(json_str):
     """Robust JSON repair for common LLM syntax errors."""
     json_str = json_str.strip()
-    json_str = re.sub(r'\}\s*\{', '}, {', json_str)
-    json_str = re.sub(r'\]\s*\[', '], [', json_str)
-    json_str = re.sub(r',\s*\}', '}', json_str)
-    json_str = re.sub(r',\s*\]', ']', json_str)
-    json_str = re.sub(r'\"\s*\n\s*\"', '", "', json_str)
-    json_str = re.sub(r'(\d+|true|false|null)\s*\n\s*\"', r'\1, "', json_str)
-    json_str = re.sub(r'\"([a-zA-Z0-9_]+)\"\s+\"([^\"]+)\"', r'"\1": "\2"', json_str)
+    json_str = _RE_OBJ_GAP.sub('}, {', json_str)
+    json_str = _RE_ARR_GAP.sub('], [', json_str)
+    json_str = _RE_TRAIL_COMMA_OBJ.sub('}', json_str)
+    json_str = _RE_TRAIL_COMMA_ARR.sub(']', json_str)
+    json_str = _RE_KV_NEWLINE.sub('", "', json_str)
+    json_str = _RE_LITERAL_NEWLINE.sub(r'\1, "', json_str)
+    json_str = _RE_MISSING_COLON.sub(r'"\1": "\2"', json_str)
     return json_str
 
+def close_json(json_str):
+    """Closes a truncated JSON string in one pass (open string + unbalanced braces/brackets)."""
+    in_string = False
+    skip_idx = -1 # index of the character consumed by a backslash escape
+    closers = []
+    for match in _RE_JSON_STRUCT.finditer(json_str):
+        i = match.start()
+        if i == skip_idx: continue
+        ch = json_str[i]
+        if in_string:
+            if ch == '\\':
+                skip_idx = i + 1
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            closers.append('}')
+        elif ch == '[':
+            closers.append(']')
+        elif ch in '}]' and closers and closers[-1] == ch:
+            closers.pop()
+
+    if in_string:
+        if skip_idx == len(json_str): json_str = json_str[:-1]
+        json_str += '"'
+    elif closers:
+        json_str = json_str.rstrip().rstrip(',')
+    return json_str + "".join(reversed(closers))
+
+def strip_md_fence(text):
+    """Returns the inside of a ```json ... ``` fenced block, or the text unchanged if it is not fenced."""
+    fence_start = text.find("```")
+    if fence_start == -1: return text
+    fence_end = text.rfind("```")
+    if fence_end == fence_start: return text
+    return text[fence_start + 3:fence_end].removeprefix("json").strip()
+
+def loads_lenient(raw):
+    """orjson parse with a stdlib fallback that tolerates raw control characters (literal newlines) in strings."""
+    try:
+        return orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return json.loads(raw, strict=False)
+
+def parse_llm_json(raw_json):
+    """Parses LLM JSON output. Strict native parse first; fence stripping and regex repair only when that fails."""
+    try:
+        return orjson.loads(raw_json)  # responseMimeType=json: usually valid as-is
+    except orjson.JSONDecodeError:
+        pass
+    
+    raw_json = strip_md_fence(raw_json.strip())
+    
+    if not raw_json.startswith("{"):
+        brace_start, brace_end = raw_json.find("{"), raw_json.rfind("}")
+        if -1 < brace_start < brace_end:
+            raw_json = raw_json[brace_start:brace_end + 1]
+    
+    try:
+        return orjson.loads(raw_json)
+    except orjson.JSONDecodeError:
+        pass
+    
+    # Truncated output (max tokens hit) is otherwise well-formed: closing it is one scan, no regex repair passes
+    closed = close_json(raw_json)
+    try:
+        return orjson.loads(closed)
+    except orjson.JSONDecodeError:
+        pass
+    
+    return loads_lenient(close_json(repair_json_content(raw_json)))
+
+def salvage_object_at(text, start_idx):
+    """Parses the object starting at start_idx by plain brace counting (string-unaware, like the original scan)."""
+    depth = 0
+    for match in _RE_BRACE.finditer(text, start_idx):
+        depth += 1 if match.group() == '{' else -1
+        if depth == 0:
+            try:
+                obj = loads_lenient(text[start_idx:match.end()])
+                return obj if isinstance(obj, dict) and "category" in obj else None
+            except:
+                return None
+    return None
+
 def salvage_json_items(text: str) -> list:
     """EMERGENCY FALLBACK: Hunts for individual JSON objects by finding balanced braces."""
     if not text: return []
-    items = []
+    found = {} # item start -> parsed object
+    open_braces = [] # positions of '{' not yet closed
+    in_string = False
+    skip_idx = -1
     
-    # Find all occurrences of the start pattern
-    start_pattern = r'\{\s*"category":'
-    for match in re.finditer(start_pattern, text):
-        start_idx = match.start()
-        
-        # Scan forward for balanced closing brace
-        brace_count = 0
-        end_idx = -1
-        for i in range(start_idx, len(text)):
-            if text[i] == '{':
-                brace_count += 1
-            elif text[i] == '}':
-                brace_count -= 1
-                if brace_count == 0:
-                    end_idx = i + 1
-                    break
-        
-        if end_idx != -1:
+    # Single pass over structural characters only; braces inside strings are ignored
+    for match in _RE_SALVAGE_TOKEN.finditer(text):
+        i = match.start()
+        if i == skip_idx: continue
+        ch = text[i]
+        if in_string:
+            if ch == '\\': skip_idx = i + 1
+            elif ch == '"': in_string = False
+            elif ch == '{' and _RE_SALVAGE_START.match(text, i):
+                # An item start can't sit inside a valid string (its quotes would be escaped):
+                # a stray quote earlier flipped the state, so resync here and drop the broken item
+                in_string = False
+                open_braces = [i]
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            open_braces.append(i)
+        elif ch == '}' and open_braces:
+            start_idx = open_braces.pop()
+            if not _RE_SALVAGE_START.match(text, start_idx): continue
             try:
-                obj_str = text[start_idx:end_idx].strip()
-                # Repair common trailing artifacts before parsing
-                if obj_str.endswith(','): obj_str = obj_str[:-1].strip()
-                
-                obj = json.loads(obj_str, strict=False)
+                obj = loads_lenient(text[start_idx:i + 1])
                 if isinstance(obj, dict) and "category" in obj:
-                    items.append(obj)
+                    found[start_idx] = obj
             except: 
                 continue
-                
+    
+    # Unbalanced quotes/escapes can still hide items from the string-aware pass:
+    # retry any missed start with a plain brace count, so nothing is lost that a per-start scan finds
+    for match in _RE_SALVAGE_START.finditer(text):
+        start_idx = match.start()
+        if start_idx not in found:
+            obj = salvage_object_at(text, start_idx)
+            if obj is not None:
+                found[start_idx] = obj
+    items = [found[start_idx] for start_idx in sorted(found)]
+    
     # --- FRAGMENT SALVAGING (for cut-off responses) ---
-    # Find the last '{"category":' that didn't have a matching '}'
-    last_item_start = text.rfind('{"category":')
-    if last_item_start != -1:
-        # Check if this start index was already processed
-        if not any(text[last_item_start:].startswith(text[match.start():match.end()]) for match in re.finditer(start_pattern, text) if (match.start() + 10) < len(text)):
-             # This is a bit complex, let's just try to patch the last fragment if items is empty or last item is missing
-             pass # Basic salvaging above is usually enough, but we can add patch logic if needed.
+    # The last '{"category":' without a matching '}' is closed deterministically
+    fragment_start = next((p for p in reversed(open_braces) if _RE_SALVAGE_START.match(text, p)), -1)
+    if fragment_start != -1 and fragment_start not in found:
+        try:
+            obj = loads_lenient(close_json(text[fragment_start:].strip()))
+            if isinstance(obj, dict) and "category" in obj:
+                obj['event_summary'] = f"{str(obj.get('event_summary') or '').strip()} [RECOVERED FRAGMENT]".strip()
+                obj['is_truncated'] = True
+                items.append(obj)
+        except:
+            pass
              
     return items
 
@@ -326,21 +570,19 @@ def extract_chunk_worker(worker_data):
     last_raw_content = ""
     api_call_count = 0
     best_parsed_items = []
+    quota_hit = False # last trial never reached the model (rate limit)
+    reminder_sent = False # schema reminder already appended to the prompt
+    retry_with_reminder = False # next trial re-asks the whole chunk instead of splitting
     
     # --- PHASE 1: PREPARE PROMPT ---
-    headline_inventory = ""
-    context_for_prompt = ""
-    for idx, item in enumerate(chunk, 1):
-        t = item.get('time', 'N/A')
-        title = item.get('title', 'No Title')
-        body = " ".join(clean_content(item.get('content', [])))
-        headline_inventory += f"- {title}\n"
-        context_for_prompt += f"--- SOURCE {idx} ---\nTITLE: {title}\nTIME: {t}\nCONTENT: {body}\n\n"
+    context_for_prompt, headline_inventory = build_chunk_context(chunk)
     
     # Adjust display index for sub-parts if we are deep in recursion
     display_name = f"Part {i_display}" if depth == 0 else f"Branch {i_display}"
     
     p = build_chunk_prompt(chunk, i_display, total_chunks, context_for_prompt, headline_inventory)
+    token_est = km.estimate_tokens(p) if km else None  # re-estimated only when the schema reminder is appended
+    title_sets = title_token_sets(chunk)  # chunk titles are fixed across retries
     
     # --- PHASE 2: TRIAL LOOP ---
     attempt, max_attempts = 0, 5
@@ -349,11 +591,12 @@ def extract_chunk_worker(worker_data):
         
         # --- ADAPTIVE BRANCHING TRIGGER ---
         # Branch if Trial 2+ starts and we still have multiple items
-        if attempt >= 2 and len(chunk) > 1:
+        # (not after a quota wait: that says nothing about the chunk, so retry it whole)
+        if attempt >= 2 and len(chunk) > 1 and not quota_hit and not retry_with_reminder:
             # --- TARGETED RESIDUAL EXTRACTION ---
             # Priority: 1. Success-but-low-yield items, 2. Regex-salvaged items
             salvaged_so_far = best_parsed_items if best_parsed_items else (salvage_json_items(last_raw_content) if last_raw_content else [])
-            missing_items = find_missing_items(chunk, salvaged_so_far)
+            missing_items = find_missing_items(chunk, salvaged_so_far, title_sets)
             
             if not missing_items:
                 worker_logs.append(f"✅ [{display_name}] Residue Check: All {len(chunk)} stories accounted for across {len(salvaged_so_far)} items!")
@@ -382,9 +625,22 @@ def extract_chunk_worker(worker_data):
             left_chunk = chunk[:mid]
             right_chunk = chunk[mid:]
             
-            # Recursive calls for sub-parts
-            res_l = extract_chunk_worker((f"{i_display}.A", left_chunk, total_chunks, selected_model, depth + 1))
-            res_r = extract_chunk_worker((f"{i_display}.B", right_chunk, total_chunks, selected_model, depth + 1))
+            # Recursive calls for sub-parts (B runs on its own thread when a request slot is free, so both halves wait on the API together)
+            # Depth is bounded by log2(len(chunk)): single-item chunks never branch
+            left_data = (f"{i_display}.A", left_chunk, total_chunks, selected_model, depth + 1)
+            right_data = (f"{i_display}.B", right_chunk, total_chunks, selected_model, depth + 1)
+            if REQUEST_SLOTS.acquire(blocking=False):
+                try:
+                    with ThreadPoolExecutor(max_workers=1) as branch_pool:
+                        future_r = branch_pool.submit(extract_chunk_worker, right_data)
+                        res_l = extract_chunk_worker(left_data)
+                        res_r = future_r.result()
+                finally:
+                    REQUEST_SLOTS.release()
+            else:
+                # No free slot: run the halves one after the other on this thread
+                res_l = extract_chunk_worker(left_data)
+                res_r = extract_chunk_worker(right_data)
             
             success_l, items_l, logs_l, calls_l = res_l
             success_r, items_r, logs_r, calls_r = res_r
@@ -404,37 +660,17 @@ def extract_chunk_worker(worker_data):
                 worker_logs.append(f"❌ [{display_name}] Branch failure persisted.")
                 return (False, combined_items, worker_logs, api_call_count)
 
+        quota_hit = retry_with_reminder = False
         try:
-            token_est = km.estimate_tokens(p) if km else "N/A"
-            worker_logs.append(f"🔹 [{display_name}] Trial {attempt} - Extraction in progress... (~{token_est} tokens)")
+            worker_logs.append(f"🔹 [{display_name}] Trial {attempt} - Extraction in progress... (~{token_est or 'N/A'} tokens)")
             api_call_count += 1
-            res = ai_client.generate_content(p, config_id=selected_model)
+            res = ai_client.generate_content(p, config_id=selected_model, est_tokens=token_est)
             
             if res['success']:
                 content = res['content']
                 last_raw_content = content 
-                raw_json = content.strip()
-                
-                # Cleanup markdown
-                if "```json" in raw_json:
-                    match = re.search(r"```json\s*(.*?)\s*```", raw_json, re.DOTALL)
-                    if match: raw_json = match.group(1).strip()
-                elif "```" in raw_json:
-                     match = re.search(r"```\s*(.*?)\s*```", raw_json, re.DOTALL)
-                     if match: raw_json = match.group(1).strip()
-                
-                if not raw_json.startswith("{"):
-                    match = re.search(r"(\{.*\})", raw_json, re.DOTALL)
-                    if match: raw_json = match.group(1).strip()
-                
-                # Robust repair
-                raw_json = repair_json_content(raw_json)
-                if raw_json.strip().endswith("}") is False:
-                     if not raw_json.strip().endswith(('"', ',', '}', ']')): raw_json += '"'
-                     if raw_json.count('{') > raw_json.count('}'): raw_json += '}]}'
-
                 try:
-                    data = json.loads(raw_json, strict=False)
+                    data = parse_llm_json(content)
                     items = data if isinstance(data, list) else data.get("news_items", [])
                     
                     # Store as best result if it has more items (or better fidelity markers in future)
@@ -443,7 +679,7 @@ def extract_chunk_worker(worker_data):
                         
                     # --- YIELD ENFORCEMENT (Fidelity-Based) ---
                     # Count actual headlines recovered rather than item count
-                    missing_now = find_missing_items(chunk, items)
+                    missing_now = find_missing_items(chunk, items, title_sets)
                     recovered_count = len(chunk) - len(missing_now)
                     min_req = len(chunk) * 0.95
                     
@@ -461,7 +697,7 @@ def extract_chunk_worker(worker_data):
                         salvaged = salvage_json_items(content)
                         if salvaged:
                             # --- YIELD ENFORCEMENT (SALVAGE Fidelity-Based) ---
-                            missing_salvage = find_missing_items(chunk, salvaged)
+                            missing_salvage = find_missing_items(chunk, salvaged, title_sets)
                             recovered_salvage = len(chunk) - len(missing_salvage)
                             if recovered_salvage < min_req and attempt < max_attempts:
                                 worker_logs.append(f"⚠️ [{display_name}] Eager Salvage Rejected: Low yield ({recovered_salvage}/{len(chunk)} headlines). Retrying...")
@@ -470,15 +706,31 @@ def extract_chunk_worker(worker_data):
                                 
                             worker_logs.append(f"⚡ [{display_name}] Eager Salvage: Recovered {recovered_salvage}/{len(chunk)} headlines.")
                             worker_logs.append(f"DEBUG_RAW_CONTENT|{content}")
-                            worker_logs.append(f"DEBUG_SALVAGED_ITEMS|{json.dumps(salvaged, indent=2)}")
+                            worker_logs.append(f"DEBUG_SALVAGED_ITEMS|{orjson.dumps(salvaged, option=orjson.OPT_INDENT_2).decode()}")
                             return (True, salvaged, worker_logs, api_call_count)
+                    if not reminder_sent and attempt < max_attempts:
+                        # Cheaper than branching: re-ask once with the schema spelled out
+                        reminder_sent = retry_with_reminder = True
+                        p += _SCHEMA_REMINDER
+                        token_est = km.estimate_tokens(p) if km else None
+                        worker_logs.append(f"🔁 [{display_name}] Unparseable JSON ({json_err}). Re-prompting once with a schema reminder...")
+                        time.sleep(1)
+                        continue
                     raise json_err
             else:
                 err_msg = res['content']
                 wait_sec = res.get('wait_seconds', 0)
                 if wait_sec > 0:
-                    worker_logs.append(f"⏳ [{display_name}] Quota hit (Key: {res.get('key_name', 'Unknown')}). Rotating keys...")
-                    time.sleep(1) 
+                    if res.get('key_name', 'N/A') != 'N/A':
+                        # A 429 on a served key only benches that key: rotate to the next one promptly
+                        wait_sec = 1
+                        worker_logs.append(f"⏳ [{display_name}] Quota hit (Key: {res['key_name']}). Rotating keys...")
+                    else:
+                        # Every key is throttled: sleep until the earliest one frees instead of re-polling KeyManager each second
+                        wait_sec = min(wait_sec, MAX_QUOTA_WAIT)
+                        worker_logs.append(f"⏳ [{display_name}] Quota hit on all keys. Waiting {wait_sec:.0f}s for the next free key...")
+                    quota_hit = True
+                    time.sleep(wait_sec)
                     continue
                 else:
                     worker_logs.append(f"❌ [{display_name}] Trial {attempt} failed: {err_msg} (Key: {res.get('key_name', 'Unknown')})")
@@ -491,18 +743,23 @@ def extract_chunk_worker(worker_data):
     if last_raw_content:
         salvaged = salvage_json_items(last_raw_content)
         if salvaged:
-            missing_final = find_missing_items(chunk, salvaged)
+            missing_final = find_missing_items(chunk, salvaged, title_sets)
             recovered_final = len(chunk) - len(missing_final)
             if recovered_final >= (len(chunk) * 0.95):
                 worker_logs.append(f"🩹 [{display_name}] Emergency Salvage: {recovered_final}/{len(chunk)} headlines.")
                 worker_logs.append(f"DEBUG_RAW_CONTENT|{last_raw_content}")
-                worker_logs.append(f"DEBUG_SALVAGED_ITEMS|{json.dumps(salvaged, indent=2)}")
+                worker_logs.append(f"DEBUG_SALVAGED_ITEMS|{orjson.dumps(salvaged, option=orjson.OPT_INDENT_2).decode()}")
                 return (True, salvaged, worker_logs, api_call_count)
             else:
                 worker_logs.append(f"❌ [{display_name}] Emergency Salvage FAILED: Yield too low ({len(salvaged)}/{len(chunk)}).")
             
     return (False, [], worker_logs, api_call_count)
 
+def extract_chunk_in_slot(worker_data):
+    """Top-level part: holds one REQUEST_SLOTS slot for its whole run (branches borrow spare ones)."""
+    with REQUEST_SLOTS:
+        return extract_chunk_worker(worker_data)
+
 
 # ==============================================================================
 #  LAY OUT
@@ -568,10 +825,11 @@ if submitted:
     st.session_state['data_loaded'] = False
     st.session_state['news_data'] = []
     st.session_state['ai_report'] = ""
+    st.session_state['extraction_results'] = None
     
     if db:
         with st.spinner("1/3 Fetching Market Data..."):
-             items = db.fetch_news_range(session_start.isoformat(), session_end.isoformat())
+             items = fetch_news_cached(session_start.isoformat(), session_end.isoformat())
 
              
              st.session_state['news_data'] = items
@@ -587,24 +845,21 @@ if submitted:
         items = st.session_state['news_data']
         st.success(f"📦 Data Fetch Complete: {len(items)} news items found.")
         with st.expander("📋 Emergency Copiable Raw Data Backup", expanded=False):
-            preview_text = f"TOTAL NEWS QUANTITY: {len(items)}\n"
-            preview_text += "=== START RAW DATA DUMP ===\n\n"
-            
-            for idx, item in enumerate(items):
-                t = item.get('time', 'N/A')
-                title = item.get('title', 'No Title')
-                body = " ".join(clean_content(item.get('content', [])))
-                preview_text += f"ITEM {idx+1}:\n[{t}] {title}\n{body}\n\n"
+            preview_text = build_raw_dump_cached(session_start.isoformat(), session_end.isoformat(), items_fingerprint(items), items)
             
-            preview_text += "=== END RAW DATA DUMP ==="
-            
-            st.info("💡 Copy the raw data below for safe-keeping. This is the exact text being processed by the AI.")
-            st.code(preview_text, language="text")
+            st.info("💡 Download the raw data below for safe-keeping. This is the exact text being processed by the AI.")
+            # on_click="ignore": a rerun here would abort the extraction that runs below
+            st.download_button("⬇️ Download Raw Data Dump", data=preview_text, file_name="raw_dump.txt", mime="text/plain", on_click="ignore")
+            # Plain text area (no syntax highlighter), capped so huge dumps don't stall the browser.
+            # disabled: an edit would rerun the script and abort the extraction below
+            st.text_area("Raw Data Preview", preview_text[:RAW_PREVIEW_MAX_CHARS], height=300, disabled=True)
+            if len(preview_text) > RAW_PREVIEW_MAX_CHARS:
+                st.caption(f"Preview truncated to the first {RAW_PREVIEW_MAX_CHARS:,} of {len(preview_text):,} characters. Use the download for the full dump.")
 
         # B. CHUNK DATA
-        # CONSERVATIVE CHUNK SIZE: 10k tokens.
+        # CONSERVATIVE CHUNK SIZE: 10k tokens (less for low-TPM models, see KeyManager.get_chunk_budget).
         # This reduces the cognitive load on the AI and minimizes branching overhead.
-        chunks = chunk_data(st.session_state['news_data'], max_tokens=10000)
+        chunks = chunk_data(st.session_state['news_data'], max_tokens=km.get_chunk_budget(selected_model))
         
         if len(chunks) > 1:
             st.toast(f"Data too large for one prompt. Split into {len(chunks)} parts.")
@@ -619,49 +874,84 @@ if submitted:
         if not ai_client:
             st.error("AI Client unavailable.")
         else:
-            import json
             # --- LIVE ETL LOGS ---
             log_expander = st.expander("🛠️ Live ETL Logs", expanded=True)
             log_container = log_expander.container()
             
             # --- START PARALLEL EXECUTION ---
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            max_threads = min(len(chunks), 15)
-            st.info(f"🚀 Scaling throughput: Initializing {max_threads} worker threads (1 per data chunk)...")
+            max_threads = min(len(chunks), MAX_CONCURRENT_REQUESTS)
+            st.info(f"🚀 Scaling throughput: Dispatching to {max_threads} pooled worker threads (1 per data chunk)...")
             
-            all_extracted_items = []
+            extracted_by_key = {} # (primary_entity, event_summary[:64]) -> item
             completed_count = 0
             total_api_calls = 0
             
-            with ThreadPoolExecutor(max_workers=max_threads) as executor:
-                future_to_chunk = {
-                    executor.submit(extract_chunk_worker, (i+1, chunk, len(chunks), selected_model, 0)): i 
-                    for i, chunk in enumerate(chunks)
-                }
-                
-                for future in as_completed(future_to_chunk):
-                    completed_count += 1
-                    success, items, logs, calls = future.result()
-                    total_api_calls += calls
-                    
-                    # Update UI
-                    for log_msg in logs:
-                        if "✅" in log_msg: log_container.success(log_msg)
-                        elif "❌" in log_msg: log_container.error(log_msg)
-                        elif "⏳" in log_msg: log_container.warning(log_msg)
-                        elif log_msg.startswith("DEBUG_RAW_CONTENT|"):
+            # UI updates are drained in batches (every 5 futures / 250ms) to keep websocket traffic low
+            # Entries are (level, text) in arrival order; consecutive lines of one level share a single element
+            pending_logs = []
+            last_flush = time.monotonic()
+            last_progress = 0.0
+            
+            def log_level(log_msg):
+                if "✅" in log_msg: return "success"
+                if "❌" in log_msg: return "error"
+                if "⏳" in log_msg: return "warning"
+                return "write"
+            
+            def flush_logs():
+                for level, group in groupby(pending_logs, key=lambda entry: entry[0]):
+                    texts = [text for _, text in group]
+                    if level == "raw":
+                        for text in texts:
                             with log_container.expander("🔍 View Salvaged Raw Response"):
-                                st.code(log_msg.split("|", 1)[1])
-                        elif log_msg.startswith("DEBUG_SALVAGED_ITEMS|"):
+                                st.code(text)
+                    elif level == "items":
+                        for text in texts:
                             with log_container.expander("📝 View Extracted Salvaged Items"):
-                                st.code(log_msg.split("|", 1)[1], language="json")
-                        else: log_container.write(log_msg)
-                        
-                    if success:
-                        all_extracted_items.extend(items)
-                    
-                    progress_bar.progress(completed_count / len(chunks))
+                                st.code(text, language="json")
+                    else:
+                        getattr(log_container, level)("\n\n".join(texts))
+                pending_logs.clear()
+            
+            executor = st.session_state['executor']
+            future_to_chunk = {
+                executor.submit(extract_chunk_in_slot, (i+1, chunk, len(chunks), selected_model, 0)): i 
+                for i, chunk in enumerate(chunks)
+            }
             
+            for future in as_completed(future_to_chunk):
+                completed_count += 1
+                success, items, logs, calls = future.result()
+                total_api_calls += calls
+                
+                # DEBUG payloads get one expander per chunk
+                chunk_raw, chunk_items = [], []
+                for log_msg in logs:
+                    if log_msg.startswith("DEBUG_RAW_CONTENT|"):
+                        chunk_raw.append(log_msg.split("|", 1)[1])
+                    elif log_msg.startswith("DEBUG_SALVAGED_ITEMS|"):
+                        chunk_items.append(log_msg.split("|", 1)[1])
+                    else:
+                        pending_logs.append((log_level(log_msg), log_msg))
+                if chunk_raw:
+                    pending_logs.append(("raw", "\n\n".join(chunk_raw)))
+                if chunk_items:
+                    pending_logs.append(("items", "\n\n".join(chunk_items)))
+
+                if success:
+                    merge_news_items(extracted_by_key, items)
+                
+                if completed_count % 5 == 0 or time.monotonic() - last_flush > 0.25:
+                    flush_logs()
+                    last_flush = time.monotonic()
+                
+                progress = completed_count / len(chunks)
+                if progress - last_progress >= 0.05:
+                    progress_bar.progress(progress)
+                    last_progress = progress
+
+            flush_logs()
+            all_extracted_items = list(extracted_by_key.values())
             progress_bar.progress(1.0)
             status_text.success("Extraction Complete!")
             time.sleep(1)
@@ -670,12 +960,10 @@ if submitted:
             
             if all_extracted_items:
                 final_dataset = {"news_items": all_extracted_items, "total_entities": len(all_extracted_items)}
-                st.session_state['ai_report'] = json.dumps(final_dataset, indent=2)
+                st.session_state['ai_report'] = orjson.dumps(final_dataset, option=orjson.OPT_INDENT_2).decode()
                 st.session_state['json_data'] = all_extracted_items
 
                 st.balloons()
-                st.divider()
-                st.subheader("✨ Optimized Token-Light Input")
                 
                 optimized_text = optimize_json_for_synthesis(all_extracted_items)
                 
@@ -683,11 +971,11 @@ if submitted:
                 original_headlines = [item.get('title', 'Unknown') for item in st.session_state['news_data']]
                 norm_original = {normalize_text(h): h for h in original_headlines}
                 
-                extracted_sources = []
+                extracted_sources = set() # the same headline often backs several items: normalize it once
                 for item in all_extracted_items:
                     sources = item.get('source_headlines', [])
                     if isinstance(sources, list):
-                        extracted_sources.extend(sources)
+                        extracted_sources.update(s for s in sources if isinstance(s, str))
                 
                 norm_extracted = {normalize_text(s) for s in extracted_sources}
                 
@@ -695,36 +983,14 @@ if submitted:
                 preserved_titles = []
                 lost_titles = []
                 
+                found_norms = match_headlines(norm_original, norm_extracted)
                 for h_norm, original_title in norm_original.items():
-                    is_found = False
-                    for s_norm in norm_extracted:
-                        # Match if one is a substring of the other or exact match
-                        if h_norm == s_norm or h_norm in s_norm or s_norm in h_norm:
-                            is_found = True
-                            break
-                    
-                    if is_found:
+                    if h_norm in found_norms:
                         preserved_titles.append(original_title)
                     else:
                         lost_titles.append(original_title)
                 
                 fidelity_score = (len(preserved_titles) / len(original_headlines) * 100) if original_headlines else 0
-                
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("✅ Data Fidelity", f"{fidelity_score:.1f}%", help="Percentage of original headlines successfully processed into the output (normalized matching).")
-                with col2:
-                    st.metric("📑 Preservation", f"{len(preserved_titles)}/{len(original_headlines)}", help="Total articles captured in final distillation.")
-                with col3:
-                    st.metric("📡 Total API Calls", f"{total_api_calls}", help="Number of times the AI was queried (including retries and branches).")
-                
-                if lost_titles:
-                    with st.expander(f"⚠️ Warning: {len(lost_titles)} Headlines potentially missing", expanded=False):
-                        st.write("The following headlines were either consolidated, identified as duplicates, or missed. Check if they are actually absent from the distillation below:")
-                        for title in sorted(list(set(lost_titles))):
-                            st.write(f"- {title}")
-                else:
-                    st.success("🎯 100% Data Integrity: All headlines accounted for.")
 
                 # --- TOKEN SAVINGS VS RAW INPUT ---
                 # Calculate total raw tokens from the actual news text being processed
@@ -732,11 +998,52 @@ if submitted:
                 opt_tokens = km.estimate_tokens(optimized_text) if km else 0
                 savings_pct = ((raw_input_tokens - opt_tokens) / raw_input_tokens * 100) if raw_input_tokens > 0 else 0
                 
-                st.info(f"💾 **Data Distillation**: Input reduced from ~{raw_input_tokens:,} to ~{opt_tokens:,} tokens (**-{savings_pct:.1f}%**)")
-                st.code(optimized_text, language="text")
-                st.success("✅ Process Complete. Copy the optimized text above for your manual AI analysis.")
+                # Computed once per run; render_results() only reads these back
+                st.session_state['extraction_results'] = {
+                    "fidelity_score": fidelity_score,
+                    "preserved_count": len(preserved_titles),
+                    "total_headlines": len(original_headlines),
+                    "lost_titles": sorted(set(lost_titles)),
+                    "total_api_calls": total_api_calls,
+                    "raw_input_tokens": raw_input_tokens,
+                    "opt_tokens": opt_tokens,
+                    "savings_pct": savings_pct,
+                    "optimized_text": optimized_text
+                }
 
-if st.session_state['data_loaded']:
+
+@st.fragment
+def render_results():
+    """Renders the stored extraction results; isolated so result-panel reruns skip the control panel."""
+    results = st.session_state.get('extraction_results')
+    if not results:
+        return
+    
     st.divider()
+    st.subheader("✨ Optimized Token-Light Input")
     
-    pass
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("✅ Data Fidelity", f"{results['fidelity_score']:.1f}%", help="Percentage of original headlines successfully processed into the output (normalized matching).")
+    with col2:
+        st.metric("📑 Preservation", f"{results['preserved_count']}/{results['total_headlines']}", help="Total articles captured in final distillation.")
+    with col3:
+        st.metric("📡 Total API Calls", f"{results['total_api_calls']}", help="Number of times the AI was queried (including retries and branches).")
+    
+    lost_titles = results['lost_titles']
+    if lost_titles:
+        with st.expander(f"⚠️ Warning: {len(lost_titles)} Headlines potentially missing", expanded=False):
+            st.write("The following headlines were either consolidated, identified as duplicates, or missed. Check if they are actually absent from the distillation below:")
+            n_pages = -(-len(lost_titles) // LOST_TITLES_PAGE_SIZE)
+            page = st.number_input("Page", min_value=1, max_value=n_pages, value=1, key="lost_titles_page") if n_pages > 1 else 1
+            page_titles = lost_titles[(page - 1) * LOST_TITLES_PAGE_SIZE:page * LOST_TITLES_PAGE_SIZE]
+            st.markdown("\n".join(f"- {title}" for title in page_titles))
+    else:
+        st.success("🎯 100% Data Integrity: All headlines accounted for.")
+
+    st.info(f"💾 **Data Distillation**: Input reduced from ~{results['raw_input_tokens']:,} to ~{results['opt_tokens']:,} tokens (**-{results['savings_pct']:.1f}%**)")
+    st.code(results['optimized_text'], language="text")
+    st.success("✅ Process Complete. Copy the optimized text above for your manual AI analysis.")
+
+if st.session_state['data_loaded']:
+    render_results()
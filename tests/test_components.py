@@ -7,7 +7,7 @@ from unittest.mock import MagicMock, patch
 # Ensure modules can be imported
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from app import salvage_json_items, repair_json_content, clean_content
+from main import salvage_json_items, repair_json_content, clean_content
 from modules.key_manager import KeyManager
 
 def test_json_repair():
@@ -46,6 +46,28 @@ def test_salvage_fragment_patching():
     assert "[RECOVERED FRAGMENT]" in items[1]['event_summary']
     assert items[1].get('is_truncated') is True
 
+def test_salvage_braces_inside_strings():
+    # Braces and escaped quotes inside string values must not affect object boundaries
+    text = """
+    noise {"category": "NEWS", "event_summary": "Fed says {rates} stay", "primary_entity": "Fed \\"}\\" Board"}
+    {"category": "TECH", "event_summary": "Brace } inside", "primary_entity": "B"}
+    """
+    items = salvage_json_items(text)
+    assert len(items) == 2
+    assert items[0]['event_summary'] == "Fed says {rates} stay"
+    assert items[0]['primary_entity'] == 'Fed "}" Board'
+    assert items[1]['event_summary'] == "Brace } inside"
+
+def test_salvage_stray_quote_keeps_later_items():
+    # An unescaped quote inside one item must not hide the items after it
+    text = (
+        '[{"category": "A", "event_summary": "screen 6.1" display", "primary_entity": "X"},'
+        '{"category": "B", "event_summary": "b", "primary_entity": "Y"},'
+        '{"category": "C", "event_summary": "c", "primary_entity": "Z"}'
+    )
+    items = salvage_json_items(text)
+    assert [item['category'] for item in items] == ["B", "C"]
+
 def test_clean_content():
     # Test cleaning of lists/nulls
     assert clean_content(["  line 1  ", None, "line 2"]) == ["line 1", "line 2"]
@@ -56,6 +78,12 @@ def test_key_manager_token_estimation():
     # Current estimate is int(len/2.5) + 1 -> 40 + 1 = 41
     assert KeyManager.estimate_tokens(text) == 41
 
+def test_key_manager_batch_token_estimation():
+    # Batched estimate must match the estimate of the joined text
+    parts = ["A" * 40, "B" * 60, ""]
+    assert KeyManager.estimate_tokens_batch(parts) == KeyManager.estimate_tokens("".join(parts))
+    assert KeyManager.estimate_tokens_batch([]) == 0
+
 @patch('modules.key_manager.libsql_client.create_client_sync')
 def test_key_manager_initialization(mock_create):
     # Mock database to allow KeyManager init
@@ -65,3 +93,55 @@ def test_key_manager_initialization(mock_create):
     km = KeyManager("libsql://test", "token")
     assert km.db_url == "https://test"
     assert mock_db.execute.called
+
+def test_key_manager_chunk_budget():
+    # Low-TPM models get a smaller chunk budget; everything else keeps the default
+    km = KeyManager.__new__(KeyManager)
+    assert km.get_chunk_budget('gemini-3.1-flash-lite-free') == KeyManager.CHUNK_TOKEN_BUDGET
+    assert km.get_chunk_budget('gemma-3-27b') == 7500
+    assert km.get_chunk_budget('unknown-model') == KeyManager.CHUNK_TOKEN_BUDGET
+
+def test_merge_news_items_dedup():
+    # Cross-chunk duplicates collapse, but their headlines are kept for fidelity checks
+    from modules.text_optimizer import merge_news_items
+    seen = {}
+    merge_news_items(seen, [{"primary_entity": "AAPL", "event_summary": "Apple beats Q3", "source_headlines": ["H1"]}])
+    merge_news_items(seen, [
+        {"primary_entity": "AAPL", "event_summary": "Apple beats Q3", "source_headlines": ["H2", "H1"]},
+        {"primary_entity": "MSFT", "event_summary": "Apple beats Q3", "source_headlines": ["H3"]},
+    ])
+    items = list(seen.values())
+    assert len(items) == 2
+    assert items[0]["source_headlines"] == ["H1", "H2"]
+
+def test_merge_news_items_keyless_and_malformed():
+    # Items with no summary are never collapsed together; non-dict entries are skipped
+    from modules.text_optimizer import merge_news_items
+    seen = {}
+    merge_news_items(seen, [{"category": "NEWS"}, "stray text", None, {"category": "TECH"}])
+    merge_news_items(seen, [{"primary_entity": "AAPL", "event_summary": ""}])
+    items = list(seen.values())
+    assert items == [{"category": "NEWS"}, {"category": "TECH"}, {"primary_entity": "AAPL", "event_summary": ""}]
+
+def test_merge_news_items_unhashable_entity():
+    # A list-valued primary_entity must not crash the merge
+    from modules.text_optimizer import merge_news_items
+    seen = {}
+    merge_news_items(seen, [
+        {"primary_entity": ["AAPL", "MSFT"], "event_summary": "Big tech rallies", "source_headlines": ["H1"]},
+        {"primary_entity": ["AAPL", "MSFT"], "event_summary": "Big tech rallies", "source_headlines": ["H2"]},
+    ])
+    items = list(seen.values())
+    assert len(items) == 1
+    assert items[0]["source_headlines"] == ["H1", "H2"]
+
+def test_response_cache_roundtrip(tmp_path):
+    # Entries are keyed by (config_id, prompt) and expire after the TTL
+    from modules.resp_cache import ResponseCache
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get('gemini-3.1-flash-lite-free', 'prompt') is None
+    cache.set('gemini-3.1-flash-lite-free', 'prompt', '{"news_items": []}')
+    assert cache.get('gemini-3.1-flash-lite-free', 'prompt') == '{"news_items": []}'
+    assert cache.get('gemini-2.5-flash-free', 'prompt') is None
+    cache.ttl = -1
+    assert cache.get('gemini-3.1-flash-lite-free', 'prompt') is None